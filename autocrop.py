@@ -6,6 +6,10 @@ crop them, optionally de-skew them, and save them.
 
 This should be considered a demonstration most of the capabilities of the
 package, not a utility for general wide-spread use.
+
+The heavy modules (numpy, PIL and the autocrop package itself) are only
+imported by the functions that need them, so that --help and --list start
+quickly. The configuration is not loaded at all for --list.
 """
 
 import argparse
@@ -17,10 +21,6 @@ import subprocess
 import sys
 import tempfile
 import time
-from simple_config import Config
-from PIL import Image
-from autocrop.image import MultiPartImage
-from autocrop.background import Background
 
 if os.name == 'posix':
     APP_CONF_DIR = os.environ.get(
@@ -32,26 +32,63 @@ else:
     sys.exit(1)
 
 AUTOCROP_DIR = os.path.join(APP_CONF_DIR, 'autocrop')
-os.makedirs(AUTOCROP_DIR, mode=0o700, exist_ok=True)
+
+# How long, in seconds, the list of detected scanners is trusted.
+SCANNER_CACHE_TTL = 24 * 60 * 60
+
+
+def make_autocrop_dir():
+    os.makedirs(AUTOCROP_DIR, mode=0o700, exist_ok=True)
 
 
 def scan(dpi, device=None):
+    from PIL import Image
+    output = scan_data(dpi, device)
+    if output is None:
+        sys.exit(1)
+        
+    image = Image.open(BytesIO(output))
+    return image
+
+
+def scan_data(dpi, device=None):
+    # Run scanimage, and return the image data, or None if it failed.
     args = ['scanimage']
     if device:
-        if isinstance(device, (list, tuple)):
-            device = device[1]
-        args.extend(['-d', device])
+        args.extend(['-d', get_device_id(device)])
     args.extend(['--resolution', str(dpi), '--mode', 'Color'])
     process = subprocess.Popen(args, stdout=subprocess.PIPE)
     output = process.communicate()[0]
     if process.returncode > 0:
-        sys.exit(1)
-        
-    image = Image.open(BytesIO(output))
-    return image
+        return None
+    return output
+
+
+def detect_scanners(refresh=False, ttl=SCANNER_CACHE_TTL):
+    """Return a list of (name, device) tuples for the available scanners.
+
+    Enumerating the SANE devices can take several seconds, so the result is
+    cached in the autocrop directory for ttl seconds, unless refresh is true.
+    """
+    cache_file = os.path.join(AUTOCROP_DIR, 'scanners.json')
+    if not refresh:
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+            if time.time() - cache['time'] < ttl:
+                return [tuple(scanner) for scanner in cache['scanners']]
+        except (OSError, ValueError, KeyError, TypeError):
+            # A missing or broken cache is the same as an expired one.
+            pass
+
+    scanners = probe_scanners()
+    if scanners:
+        # Don't cache an empty result; the scanner may just be switched off.
+        save_json(cache_file, {'time': time.time(), 'scanners': scanners})
+    return scanners
 
 
-def detect_scanners():
+def probe_scanners():
     process = subprocess.Popen(['scanimage', '-L'], stdout=subprocess.PIPE)
     scanners = []
     for line in process.stdout.readlines():
@@ -65,22 +102,27 @@ def detect_scanners():
     return scanners
 
 
-def get_default_scanner():
+def get_default_scanner(refresh=False):
     if 'SANE_DEFAULT_DEVICE' in os.environ:
         return os.environ['SANE_DEFAULT_DEVICE']
-    scanners = detect_scanners()
+    scanners = detect_scanners(refresh)
     if not scanners:
         sys.stderr.write('No scanners found.\n')
         sys.exit(1)
     return scanners[0]
 
 
+def get_device_id(device):
+    if isinstance(device, (list, tuple)):
+        device = device[1]
+    return device
+
+
 def get_scanner_base_name(device):
     if isinstance(device, (list, tuple)):
         device = device[0]
     
     name = device.partition('(')[0].strip()
-    print(name)
     return name
 
 
@@ -102,6 +144,11 @@ def parse_commandline_options(defaults):
         action='store_true',
         help="List available scanning devices."
         )
+    parser.add_argument(
+        '--refresh-scanners',
+        action='store_true',
+        help='Detect the scanning devices again instead of using the cached list.'
+        )
     parser.add_argument(
         '-r', '--resolution',
         nargs='?',
@@ -115,11 +162,30 @@ def parse_commandline_options(defaults):
     parser.add_argument(
         '-p', '--precision',
         nargs='?',
-        type=int,
+        type=precision_type,
         default=defaults.precision,
         help=(
             'The precision to use while cropping. Higher is better '
-            'but slower (default: 50).'
+            'but slower. Use "auto" to derive it from --min-size and '
+            '--min-gap (default: 50).'
+            )
+        )
+    parser.add_argument(
+        '--min-size',
+        type=float,
+        default=defaults.min_size,
+        help=(
+            'The length, in inches, of the shortest side of the smallest '
+            'photo. Anything smaller is ignored (default: 1).'
+            )
+        )
+    parser.add_argument(
+        '--min-gap',
+        type=float,
+        default=defaults.min_gap,
+        help=(
+            'The smallest distance, in inches, between two photos. Only used '
+            'with --precision auto (default: 0.25).'
             )
         )
     parser.add_argument(
@@ -131,11 +197,25 @@ def parse_commandline_options(defaults):
             'the system default is used.'
             )
         )
+    parser.add_argument(
+        '-m', '--multiple',
+        nargs='*',
+        metavar='SCANNER',
+        help=(
+            'Scan with several scanners at the same time, and save the photos '
+            'from each in its own subdirectory of the target. If no scanners '
+            'are given, all available scanners are used.'
+            )
+        )
     parser.add_argument(
         '-f', '--filename',
         nargs='*',
         default='',
-        help='Do not scan. Instead, load the image from the given file(s).'
+        help=(
+            'Do not scan. Instead, load the images from the given file(s) or '
+            'directories, or from standard input if the name is -. Each page '
+            'of a multi-page file is cropped separately.'
+            )
         )
     parser.add_argument(
         '-c', '--contrast',
@@ -148,6 +228,17 @@ def parse_commandline_options(defaults):
             'and foreground. (default: 5).'
             )
         )
+    parser.add_argument(
+        '-e', '--engine',
+        nargs='?',
+        choices=['auto', 'sampler', 'array'],
+        default=defaults.engine,
+        help=(
+            'The implementation used to find and deskew the photos. The '
+            'array engine is much faster than the reference sampler engine '
+            '(default: auto).'
+            )
+        )
     parser.add_argument(
         '-d', '--disable-deskew',
         action='store_true',
@@ -183,6 +274,29 @@ def parse_commandline_options(defaults):
             '(not by -f <file>), an additional file original-<name>.jpg is created (default: False)'
             )
         )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        help=(
+            'Run a local crop service instead of cropping once. The '
+            'service keeps its workers warm between requests.'
+            )
+        )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8765,
+        help='The localhost port used by --serve (default: 8765).'
+        )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help=(
+            'Number of worker processes used by --serve and --multiple '
+            '(default: the number of CPUs).'
+            )
+        )
     parser.add_argument(
         'target',
         nargs='?',
@@ -198,20 +312,40 @@ def parse_commandline_options(defaults):
     return options
 
 
-def list_all_scanners():
+def parse_list_options():
+    # Listing the scanners doesn't need the configuration, so --list is
+    # picked out before it is loaded.
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-h', '--help', action='store_true')
+    parser.add_argument('-l', '--list', action='store_true')
+    parser.add_argument('--refresh-scanners', action='store_true')
+    return parser.parse_known_args()[0]
+
+
+def precision_type(value):
+    if value == 'auto':
+        return value
+    return int(value)
+
+
+def list_all_scanners(refresh=False):
     # List all scanners.
-    for name, device in detect_scanners():
+    for name, device in detect_scanners(refresh):
         print(name)
 
 
 def get_config_params():
+    from simple_config import Config
     default_params = {
         "resolution": 300,
         "shrink": 0,
         "contrast": 5,
         "precision": 50,
         "filetype": "png",
-        "framed_crop": False
+        "framed_crop": False,
+        "engine": "auto",
+        "min_size": 1.0,
+        "min_gap": 0.25
     }
     return Config(os.path.join(AUTOCROP_DIR, 'config.json'), defaults=default_params)
 
@@ -221,35 +355,149 @@ def scan_and_save_background_data(options, background, bg_records, bg_file):
     if options.scanner:
         devices = [options.scanner]
     else:
-        devices = ['', get_default_scanner()]
+        devices = ['', get_default_scanner(options.refresh_scanners)]
     image = scan(options.resolution, options.scanner)
     background.load_from_image(image, options.resolution)
     for device in devices:
         name = get_scanner_base_name(device)
         bg_records[name] = (background.medians, background.std_devs)
-    temp_bg_file = tempfile.NamedTemporaryFile(
+    save_json(bg_file, bg_records)
+
+
+def save_json(file_name, data):
+    # Write to a temporary file first, so a crash never leaves a broken file.
+    temp_file = tempfile.NamedTemporaryFile(
         mode='w',
-        dir=AUTOCROP_DIR,
+        dir=os.path.dirname(file_name),
         delete=False
     )
-    temp_bg_file_name = temp_bg_file.name
+    temp_file_name = temp_file.name
     try:
-        json.dump(bg_records, temp_bg_file)
+        json.dump(data, temp_file)
     except:
-        os.remove(temp_bg_file_name)
+        os.remove(temp_file_name)
         raise
     finally:
-        temp_bg_file.close()
+        temp_file.close()
 
-    os.rename(temp_bg_file_name, bg_file)
+    os.rename(temp_file_name, file_name)
 
 
-def autocrop_file(options, image, background, filename_origin):
-    # Autocrop a file.
+def scan_and_crop_all(options, devices, bg_records):
+    # Scan with all the devices in parallel, and crop the scans in a shared
+    # pool of worker processes as soon as each one is done.
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from copy import copy
     date_name = time.strftime(
         '%Y-%m-%d-%H%M%S',
         time.localtime(time.time())
     )
+
+    def scan_device(device):
+        print(f'Scanning with {get_device_id(device)}')
+        data = scan_data(options.resolution, device)
+        if data is None:
+            return None
+        device_options = copy(options)
+        device_options.target = os.path.join(
+            options.target, get_device_directory(device)
+        )
+        background = get_background(bg_records, device)
+        return pool.submit(
+            autocrop_data, device_options, data, background, date_name
+        )
+
+    failed = []
+    with ProcessPoolExecutor(options.workers) as pool:
+        with ThreadPoolExecutor(len(devices)) as threads:
+            jobs = list(threads.map(scan_device, devices))
+        for device, job in zip(devices, jobs):
+            if job is None:
+                failed.append(device)
+                sys.stderr.write(f'Scanning with {get_device_id(device)} failed.\n')
+                continue
+            try:
+                job.result()
+            except Exception as e:
+                failed.append(device)
+                sys.stderr.write(
+                    f'Cropping the scan from {get_device_id(device)} failed: {e}\n'
+                )
+    return failed
+
+
+def rescan_stale_devices(options, devices, failed, bg_records):
+    # The device ids of USB scanners change when they are plugged in again,
+    # so a failure may only mean that the cached list of scanners is out of
+    # date. Detect the scanners again, and scan with any that have new ids
+    # in place of the failed ones that are gone. Return the devices that
+    # still failed.
+    known = {get_device_id(device) for device in devices}
+    scanners = detect_scanners(refresh=True)
+    retry = [device for device in scanners if get_device_id(device) not in known]
+    if not retry:
+        return failed
+    sys.stderr.write(
+        'The list of scanners was out of date, '
+        'scanning with the ones found now.\n'
+    )
+    current = {get_device_id(device) for device in scanners}
+    failed = [device for device in failed if get_device_id(device) in current]
+    return failed + scan_and_crop_all(options, retry, bg_records)
+
+
+def get_device_directory(device):
+    # A file name made from the device id, which is unique on the system.
+    return ''.join(c if c.isalnum() else '-' for c in get_device_id(device))
+
+
+def get_background(bg_records, device):
+    # Prefer a record for this particular device over one for its model.
+    from autocrop.background import Background
+    for name in (get_device_id(device), get_scanner_base_name(device)):
+        if name in bg_records:
+            return Background(*bg_records[name])
+    return Background()
+
+
+def crop_files(options, names, background):
+    # Autocrop every page of the given files. The crops are named after the
+    # time of the run, the path of the file and the page number, and a
+    # number is added to names that would otherwise repeat.
+    from autocrop.pages import iter_scans
+    run = time.strftime('%Y-%m-%d-%H%M%S', time.localtime(time.time()))
+    used = set()
+    for filename, index, image in iter_scans(names):
+        print(f'autocrop {filename} page {index + 1}')
+        stem, ext = os.path.splitext(filename)
+        stem = stem.replace(os.sep, '-')
+        base_name = f'{run}-{stem}-p{index + 1:03d}'
+        count = 1
+        while base_name in used:
+            count += 1
+            base_name = f'{run}-{stem}-{count}-p{index + 1:03d}'
+        used.add(base_name)
+        autocrop_file(
+            options, image, background, base_name + (ext or '.png'), base_name
+        )
+
+
+def autocrop_data(options, data, background, base_name):
+    # Autocrop encoded image data, in a worker process.
+    from PIL import Image
+    image = Image.open(BytesIO(data))
+    autocrop_file(options, image, background, base_name + '.jpg', base_name)
+
+
+def autocrop_file(options, image, background, filename_origin, base_name=None):
+    # Autocrop a file. The crops are named after base_name, or after the
+    # current time if no name is given.
+    from autocrop.image import MultiPartImage
+    if base_name is None:
+        base_name = time.strftime(
+            '%Y-%m-%d-%H%M%S',
+            time.localtime(time.time())
+        )
     letters = iter('abcdefghijklmnopqrstuvwxyz')
     target = os.path.abspath(options.target)
     if not os.path.exists(target):
@@ -262,10 +510,13 @@ def autocrop_file(options, image, background, filename_origin):
         options.precision,
         options.deskew,
         options.contrast,
-        options.shrink
+        options.shrink,
+        options.engine,
+        options.min_size,
+        options.min_gap
     )
     for crop in multipart_image:
-        file_name = f'{date_name}-{next(letters)}.{options.filetype}'
+        file_name = f'{base_name}-{next(letters)}.{options.filetype}'
         full_path = os.path.join(target, file_name)
         print('Saving %s' % full_path)
         crop.save(full_path)
@@ -276,7 +527,19 @@ def autocrop_file(options, image, background, filename_origin):
 
 
 def main():
+    make_autocrop_dir()
+    list_options = parse_list_options()
+    if list_options.list and not list_options.help:
+        list_all_scanners(list_options.refresh_scanners)
+        return
+
     options = parse_commandline_options(get_config_params())
+    if options.list:
+        list_all_scanners(options.refresh_scanners)
+        return
+
+    from autocrop.background import Background
+
     bg_file = os.path.join(AUTOCROP_DIR, 'backgrounds.json')
     try:
         with open(bg_file, 'r') as f:
@@ -293,18 +556,42 @@ def main():
     else:
         background = Background()
     
-    if options.list:
-        list_all_scanners()
-    
-    elif options.blank:
+    if options.blank:
         scan_and_save_background_data(options, background, bg_records, bg_file)
+
+    elif options.multiple is not None:
+        if options.multiple:
+            devices = options.multiple
+        else:
+            devices = detect_scanners(options.refresh_scanners)
+        if not devices:
+            sys.stderr.write('No scanners found.\n')
+            sys.exit(1)
+        failed = scan_and_crop_all(options, devices, bg_records)
+        if failed and not options.multiple and not options.refresh_scanners:
+            failed = rescan_stale_devices(options, devices, failed, bg_records)
+        if failed:
+            sys.exit(1)
+
+    elif options.serve:
+        from autocrop.server import serve
+        defaults = {
+            'scanner': device_name,
+            'dpi': options.resolution,
+            'precision': options.precision,
+            'deskew': options.deskew,
+            'contrast': options.contrast,
+            'shrink': options.shrink,
+            'filetype': options.filetype,
+            'engine': options.engine,
+            'min_size': options.min_size,
+            'min_gap': options.min_gap,
+            }
+        serve(options.port, bg_records, options.workers, defaults)
     
     else:
         if options.filename:
-            for filename in options.filename:
-                print(f'autocrop {filename}')
-                image = Image.open(filename)
-                autocrop_file(options, image, background, os.path.basename(filename))
+            crop_files(options, options.filename, background)
         else:
             image = scan(options.resolution, options.scanner)
             if options.framed_crop:
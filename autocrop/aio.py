@@ -0,0 +1,170 @@
+# Copyright 2011 Michael Saavedra
+
+"""An asyncio interface for cropping scans.
+
+Decoding, detection, deskewing and encoding all run in the threads of a
+CropExecutor, so the event loop stays free while scans are cropped:
+
+>>> photos = await autocrop.aio.crop(image_bytes, background, dpi=300)
+
+or, to handle each photo as soon as it is ready:
+
+>>> async for photo in autocrop.aio.iter_crops(image_bytes, background, 300):
+...     await store(photo)
+
+The executor only lets a limited number of scans be in progress at once, and
+the rest wait for a free slot, which gives backpressure to busy callers.
+Cancelling a crop takes effect once the step running in a worker thread has
+finished, so the slot of a scan is never freed while its work goes on. A
+caller that stops iterating early should aclose() the iterator, so its slot
+is freed right away rather than when the iterator is garbage collected.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+import os
+from weakref import WeakKeyDictionary
+
+from PIL import Image
+
+from .image import MultiPartImage
+from .pages import iter_pages
+
+_default_executor = None
+
+
+class CropExecutor(object):
+    """A thread pool for crop work, with a limit on the scans in progress.
+
+    With the engine picked by "auto", most of the time is spent in numpy
+    and PIL, which release the GIL, so threads are enough to keep the event
+    loop responsive. The pure python sampler engine holds the GIL, and
+    stalls the loop for longer.
+    """
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(self.max_workers)
+        # Semaphores are bound to the event loop they are used on.
+        self._semaphores = WeakKeyDictionary()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+        return self._semaphores[loop]
+
+    async def acquire(self):
+        """Wait for a free slot for a scan.
+        """
+        await self._get_semaphore().acquire()
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+        self._get_semaphore().release()
+
+    async def run(self, func, *args, **kwargs):
+        """Run a function in one of the worker threads.
+
+        A thread can't be interrupted, so if the caller is cancelled this
+        still waits for the function to finish before raising
+        CancelledError.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor, partial(func, *args, **kwargs)
+            )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            while not future.done():
+                try:
+                    await asyncio.wait([future])
+                except asyncio.CancelledError:
+                    pass
+            if not future.cancelled():
+                # The result is no longer wanted, nor is any error.
+                future.exception()
+            raise
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+
+def get_default_executor():
+    """Return the executor used when none is given, creating it if needed.
+    """
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = CropExecutor()
+    return _default_executor
+
+
+def set_default_executor(executor):
+    global _default_executor
+    _default_executor = executor
+
+
+async def crop(source, background, dpi, precision=50, deskew=True,
+        contrast=15, shrink=3, engine='auto', min_size=1.0, min_gap=0.25,
+        format='PNG', executor=None):
+    """Return a list of the photos in a scan, encoded in the given format.
+
+    The source is either the encoded image data or a path to an image file,
+    and the other arguments are the same as those of MultiPartImage. Every
+    page of a multi-page image is cropped.
+    """
+    return [photo async for photo in iter_crops(
+        source, background, dpi, precision, deskew, contrast, shrink,
+        engine, min_size, min_gap, format, executor,
+        )]
+
+
+async def iter_crops(source, background, dpi, precision=50, deskew=True,
+        contrast=15, shrink=3, engine='auto', min_size=1.0, min_gap=0.25,
+        format='PNG', executor=None):
+    """Asynchronously iterate over the photos in a scan.
+
+    The arguments are the same as those of crop(). If format is None, the
+    photos are PIL images instead of encoded data.
+    """
+    if executor is None:
+        executor = get_default_executor()
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+
+    await executor.acquire()
+    try:
+        image = await executor.run(Image.open, source)
+        try:
+            pages = iter_pages(image)
+            while True:
+                # The pages share a decoder, so they are read one at a time.
+                page = await executor.run(next, pages, None)
+                if page is None:
+                    break
+                multipart_image = await executor.run(
+                    MultiPartImage, page[1], background, dpi, precision, deskew,
+                    contrast, shrink, engine, min_size, min_gap,
+                    )
+                for section in multipart_image.sections:
+                    yield await executor.run(
+                        _crop_section, multipart_image, section, format
+                        )
+        finally:
+            image.close()
+    finally:
+        executor.release()
+
+
+def _crop_section(multipart_image, section, format):
+    photo = multipart_image.crop_section(section)[0]
+    if format is None:
+        return photo
+    buf = BytesIO()
+    photo.save(buf, format=format)
+    return buf.getvalue()
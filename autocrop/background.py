@@ -54,3 +54,33 @@ class Background(object):
             if delta > self.std_devs[color] * spread:
                 return False
         return True
+    
+    def matches_array(self, pixels, spread):
+        """Vectorized version of matches() for an array of RGB pixels.
+        
+        The last axis of the array holds the color channels, and the return
+        value is a boolean array with the shape of the remaining axes.
+        """
+        result = np.ones(pixels.shape[:-1], dtype=bool)
+        for channel, color in enumerate(('red', 'green', 'blue')):
+            # Subtract as floats, so 8 bit pixels can't wrap around.
+            delta = np.abs(float(self.medians[color]) - pixels[..., channel])
+            result &= delta <= self.std_devs[color] * spread
+        return result
+    
+    def thresholds(self, spread):
+        """Return the lowest and highest values that match, for each channel.
+        
+        For 8 bit pixels, comparing against these is equivalent to matches(),
+        but avoids the floating point arithmetic. The values are limited to
+        -1 and 256, so a channel that can never match has lower > upper.
+        """
+        lower = []
+        upper = []
+        for color in ('red', 'green', 'blue'):
+            tolerance = self.std_devs[color] * spread
+            lower.append(np.ceil(self.medians[color] - tolerance))
+            upper.append(np.floor(self.medians[color] + tolerance))
+        lower = np.clip(lower, -1, 256).astype(np.int16)
+        upper = np.clip(upper, -1, 256).astype(np.int16)
+        return lower, upper
@@ -0,0 +1,271 @@
+# Copyright 2011 Michael Saavedra
+
+"""Interchangeable implementations of section detection and deskewing.
+
+Every engine must find the same sections as the reference "sampler" engine
+(within one sampling step) and the same angles, which is checked by the
+conformance tests in tests/test_engines.py. Engines are registered by name
+with the register() decorator, and get_engine() looks them up.
+"""
+
+import numpy
+
+from .sampler import PixelSampler
+from .section import ImageSection
+from .skew import SkewedImage, analyze_sections
+
+ENGINES = {}
+
+
+def register(name):
+    """Class decorator that adds an engine to the registry.
+    """
+    def decorator(cls):
+        cls.name = name
+        ENGINES[name] = cls
+        return cls
+    return decorator
+
+
+def select_engine(image):
+    """Pick the name of the fastest engine that can handle an image.
+
+    The array engine is faster than the sampler at every image size, but
+    it needs at least three color bands to read as an array.
+    """
+    if len(image.getbands()) >= 3:
+        return 'array'
+    else:
+        return 'sampler'
+
+
+def get_engine(name, image=None):
+    """Return an instance of the engine with the given name.
+
+    The name "auto" selects an engine based on the image.
+    """
+    if name == 'auto':
+        name = select_engine(image)
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError('Unknown engine: %s' % name) from None
+
+
+@register('sampler')
+class SamplerEngine(object):
+    """Find sections by flood filling a grid of pixel samples.
+    """
+    def find_sections(self, image, background, dpi, precision, contrast,
+            min_area=0):
+        """Return the sections of the image that aren't background.
+
+        Contiguous areas no larger than min_area are dropped as soon as they
+        are found, and the remaining sections that overlap are merged.
+        """
+        samples = PixelSampler(image, dpi, precision)
+        sections = []
+        pruned = set()
+        for pixel in samples:
+            # Skip if the sample is background or is already in a section.
+            color_data = pixel[2:]
+            location_data = pixel[:2]
+            if background.matches(color_data, contrast):
+                continue
+            if location_data in pruned:
+                continue
+            if True in (location_data in section for section in sections):
+                continue
+
+            # Find contiguous samples. This works like a 4-way flood fill, but
+            # instead of changing the color we just collect the coordinates.
+            seeds = [location_data]
+            pixels = set(seeds)
+            for seed in iter(seeds):
+                for x, y, r, g, b in samples.around(*seed):
+                    location = (x, y)
+                    color = (r, g, b)
+                    if location not in pixels:
+                        pixels.add(location)
+                        if not background.matches(color, contrast):
+                            seeds.append(location)
+
+            new_section = ImageSection(pixels)
+            if not new_section > min_area:
+                pruned.update(seeds)
+                continue
+
+            if True in (s.merge_if_overlapping(new_section) for s in sections):
+                continue
+
+            sections.append(new_section)
+
+        return sections
+
+    def analyze_sections(self, image, sections, background, contrast, shrink):
+        """Return the margins and angle of rotation of each section.
+
+        The margins (left, upper, right, lower) are those of the section
+        once it is rotated, and the angles are in degrees.
+        """
+        results = []
+        for section in sections:
+            image_section = image.crop(
+                (section.left, section.top, section.right, section.bottom)
+                )
+            skew = SkewedImage(image_section, background, contrast, shrink)
+            results.append(skew.analyze())
+        return results
+
+
+@register('array')
+class ArrayEngine(SamplerEngine):
+    """Find sections by labelling the sample grid with numpy.
+
+    The grid is the same one the sampler engine walks, but all samples are
+    read and compared to the background at once, and the connected
+    components are found from runs of foreground samples on each row. The
+    margins of all sections are also found at once, by analyze_sections().
+    """
+    def find_sections(self, image, background, dpi, precision, contrast,
+            min_area=0):
+        step = PixelSampler.get_step(dpi, precision)
+        width, height = image.size
+        xs = grid_positions(width, step)
+        ys = grid_positions(height, step)
+        grid = numpy.asarray(image)[numpy.ix_(ys, xs)][..., :3]
+        foreground = ~background.matches_array(grid, contrast)
+
+        return build_sections(find_components(foreground), xs, ys, min_area)
+
+    def analyze_sections(self, image, sections, background, contrast, shrink):
+        boxes = [(s.left, s.top, s.right, s.bottom) for s in sections]
+        return analyze_sections(
+            numpy.asarray(image), boxes, background, contrast, shrink
+            )
+
+
+def build_sections(components, xs, ys, min_area=0):
+    """Turn the components of a sample grid into merged image sections.
+
+    The components are lists of runs as returned by find_components(), and
+    xs and ys are the pixel positions of the grid columns and rows. This
+    gives the same sections as the flood fill of the sampler engine.
+
+    Merging sections isn't transitive, so the components are handled in the
+    same order as the flood fill handles them: when the walk over the grid,
+    row by row, first comes to one of their samples that isn't inside a
+    section yet.
+    """
+    order = sorted(
+        (run, index)
+        for index, runs in enumerate(components)
+        for run in runs
+        )
+    handled = [False] * len(components)
+    sections = []
+    for run, index in order:
+        if handled[index] or _covered(run, xs, ys, sections):
+            continue
+        handled[index] = True
+        runs = components[index]
+
+        # Like the flood fill, include the neighbouring background samples
+        # in the section.
+        rows = [row for row, start, end in runs]
+        top = max(min(rows) - 1, 0)
+        bottom = min(max(rows) + 1, len(ys) - 1)
+        left = max(min(start for row, start, end in runs) - 1, 0)
+        right = min(max(end for row, start, end in runs), len(xs) - 1)
+        new_section = ImageSection((
+            (int(xs[left:right + 1].min()), int(ys[top:bottom + 1].min())),
+            (int(xs[left:right + 1].max()), int(ys[top:bottom + 1].max())),
+            ))
+        if not new_section > min_area:
+            continue
+
+        if True in (s.merge_if_overlapping(new_section) for s in sections):
+            continue
+
+        sections.append(new_section)
+
+    return sections
+
+
+def _covered(run, xs, ys, sections):
+    """Return True if every sample of a run is inside some section.
+    """
+    row, start, end = run
+    y = ys[row]
+    uncovered = numpy.ones(end - start, dtype=bool)
+    for section in sections:
+        if section.top <= y <= section.bottom:
+            uncovered &= (
+                (xs[start:end] < section.left) | (xs[start:end] > section.right)
+                )
+    return not uncovered.any()
+
+
+def grid_positions(length, step):
+    """Return the sample positions PixelSampler uses along one axis.
+    """
+    positions = [step]
+    maximum = length - step - 1
+    while positions[-1] != maximum:
+        positions.append(min(positions[-1] + step, maximum))
+    return numpy.array(positions)
+
+
+def find_components(mask, padded=None, edges=None):
+    """Find the 4-connected components of a two dimensional boolean array.
+
+    Each component is returned as a list of (row, start, end) runs, and the
+    components are ordered by their first sample in row-major order. The
+    padded and edges arrays are scratch space that may be passed in to be
+    reused; they are int8 arrays with two and one more columns than the
+    mask, and the first and last columns of padded must be zero.
+    """
+    rows, columns = mask.shape
+    if padded is None:
+        padded = numpy.zeros((rows, columns + 2), dtype=numpy.int8)
+    if edges is None:
+        edges = numpy.empty((rows, columns + 1), dtype=numpy.int8)
+    padded[:, 1:-1] = mask
+    numpy.subtract(padded[:, 1:], padded[:, :-1], out=edges)
+
+    parents = []
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    runs = []
+    previous = []
+    for row in range(rows):
+        starts = numpy.flatnonzero(edges[row] == 1)
+        ends = numpy.flatnonzero(edges[row] == -1)
+        current = []
+        j = 0
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            index = len(runs)
+            runs.append((row, start, end))
+            parents.append(index)
+            current.append(index)
+            # Join with the runs on the previous row that share a column.
+            while j < len(previous) and runs[previous[j]][2] <= start:
+                j += 1
+            k = j
+            while k < len(previous) and runs[previous[k]][1] < end:
+                a, b = find(index), find(previous[k])
+                parents[max(a, b)] = min(a, b)
+                k += 1
+        previous = current
+
+    components = {}
+    for index, run in enumerate(runs):
+        components.setdefault(find(index), []).append(run)
+    # Runs are numbered in row-major order, so the smallest root of each
+    # component is its first run.
+    return [components[root] for root in sorted(components)]
@@ -0,0 +1,454 @@
+# Copyright 2011 Michael Saavedra
+
+"""Measure the accuracy and speed of cropping settings on synthetic scans.
+
+Scans with photos at known positions and angles are generated, and every
+combination of the given engines, precisions, contrasts and shrinks is used
+to crop them. For each setting this reports how well the deskewed crops
+cover the true photos (their mean intersection over union), the mean and
+largest errors in the angles, the photos that were missed and the false
+photos that were found, the pages cropped per second and the peak memory
+used. Settings that no other setting beats on both accuracy and speed are
+marked as being on the Pareto front:
+
+    python -m autocrop.evaluate --precision 10 25 50 auto --shrink 0 3
+
+With --min-iou and --max-angle-error, the fastest setting that meets those
+requirements is also reported.
+
+Peak memory is measured on the first scan, in a separate run from the
+timing. The scan is cropped in a forked child process, and the growth of
+the child's peak resident set size is reported. This counts the memory
+used by PIL as well as by numpy and Python objects. tracemalloc only sees
+the last two, which made the array engine look far heavier than the
+sampler. With glibc, freed memory is returned to the system before the
+fork, so the child can't reuse it without it being counted; elsewhere the
+figures may be too low.
+"""
+
+import argparse
+from collections import namedtuple
+import ctypes
+import ctypes.util
+from itertools import product
+import multiprocessing
+import resource
+import time
+
+import numpy
+
+from .background import Background
+from .image import MultiPartImage
+from .skew import deskew_matrix
+from .synthetic import make_scan
+
+# Crops that cover less of a photo than this don't count as finding it.
+MATCH_IOU = 0.5
+
+Setting = namedtuple('Setting', ('engine', 'precision', 'contrast', 'shrink'))
+
+Result = namedtuple('Result', (
+    'setting', 'iou', 'angle_error', 'max_angle_error', 'missed', 'false',
+    'pages_per_second', 'peak_memory',
+    ))
+
+
+def make_scans(count, dpi=100, max_angle=8.0, noise=1.0, seed=0):
+    """Return a list of (image, labels) for random letter sized scans.
+
+    Each scan has its photos laid out on a grid of one to three columns and
+    one to four rows, with at least a quarter inch between them. The photos
+    take up half to four fifths of their cells, less if they don't fit once
+    turned, and are turned by up to max_angle degrees either way.
+    """
+    random = numpy.random.RandomState(seed)
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    gap = dpi / 4.0
+    scans = []
+    for index in range(count):
+        columns = random.randint(1, 4)
+        rows = random.randint(1, 5)
+        cell_width = width / float(columns)
+        cell_height = height / float(rows)
+        photos = []
+        for row, column in product(range(rows), range(columns)):
+            angle = random.uniform(-max_angle, max_angle)
+            photo_width = cell_width * random.uniform(0.5, 0.8)
+            photo_height = cell_height * random.uniform(0.5, 0.8)
+
+            # Shrink the photo until it fits in its cell once it is turned.
+            a = numpy.radians(abs(angle))
+            box_width = photo_width * numpy.cos(a) + photo_height * numpy.sin(a)
+            box_height = photo_width * numpy.sin(a) + photo_height * numpy.cos(a)
+            scale = min(
+                1.0,
+                (cell_width - 2 * gap) / box_width,
+                (cell_height - 2 * gap) / box_height,
+                )
+            photo_width *= scale
+            photo_height *= scale
+            box_width *= scale
+            box_height *= scale
+
+            center_x = (column * cell_width + gap + box_width / 2.0
+                + random.uniform(0, cell_width - 2 * gap - box_width))
+            center_y = (row * cell_height + gap + box_height / 2.0
+                + random.uniform(0, cell_height - 2 * gap - box_height))
+            photos.append(
+                (center_x, center_y, photo_width, photo_height, angle)
+                )
+        scans.append(make_scan(
+            photos, (width, height), noise=noise, seed=seed + index
+            ))
+    return scans
+
+
+def make_background(dpi=100, noise=1.0, seed=0):
+    """Return the background of the synthetic scans, from a blank one.
+    """
+    blank, labels = make_scan(
+        [], (int(8.5 * dpi), int(11 * dpi)), noise=noise, seed=seed
+        )
+    return Background().load_from_image(blank, dpi)
+
+
+def crop_scan(image, background, dpi, setting):
+    """Crop the photos out of a scan with the given setting.
+
+    Returns a list of (crop, corners, angle) tuples, where the corners are
+    the positions on the scan of the corners of the crop.
+    """
+    images = MultiPartImage(
+        image, background, dpi, setting.precision, True, setting.contrast,
+        setting.shrink, setting.engine,
+        )
+    crops = []
+    for section in images.sections:
+        crop, margins, angle = images.crop_section(section)
+        box = (section.left, section.top, section.right, section.bottom)
+        a, b, c, d, e, f = deskew_matrix(box, margins, angle)
+        width, height = crop.size
+        corners = [
+            (a * x + b * y + c, d * x + e * y + f)
+            for x, y in ((0, 0), (width, 0), (width, height), (0, height))
+            ]
+        crops.append((crop, corners, angle))
+    return crops
+
+
+def match_crops(crops, labels):
+    """Pair up crops and labels, best overlap first.
+
+    Returns a list of (iou, angle_error) for the pairs, and the numbers of
+    labels and crops that were left over.
+    """
+    candidates = []
+    for i, (crop, corners, angle) in enumerate(crops):
+        for j, label in enumerate(labels):
+            iou = polygon_iou(corners, label.corners)
+            if iou >= MATCH_IOU:
+                candidates.append((iou, i, j))
+    candidates.sort(reverse=True)
+
+    matches = []
+    used_crops = set()
+    used_labels = set()
+    for iou, i, j in candidates:
+        if i in used_crops or j in used_labels:
+            continue
+        used_crops.add(i)
+        used_labels.add(j)
+        matches.append((iou, abs(crops[i][2] - labels[j].angle)))
+    return (
+        matches,
+        len(labels) - len(used_labels),
+        len(crops) - len(used_crops),
+        )
+
+
+def evaluate_setting(scans, background, dpi, setting):
+    """Crop every scan with one setting, and return a Result.
+    """
+    elapsed = 0.0
+    matches = []
+    missed = false = 0
+    for image, labels in scans:
+        start = time.perf_counter()
+        crops = crop_scan(image, background, dpi, setting)
+        elapsed += time.perf_counter() - start
+        scan_matches, scan_missed, scan_false = match_crops(crops, labels)
+        matches.extend(scan_matches)
+        missed += scan_missed
+        false += scan_false
+
+    peak_memory = measure_memory(scans[0][0], background, dpi, setting)
+
+    if matches:
+        ious, angle_errors = list(zip(*matches))
+    else:
+        ious, angle_errors = [0.0], [0.0]
+    return Result(
+        setting,
+        float(numpy.mean(ious)),
+        float(numpy.mean(angle_errors)),
+        float(numpy.max(angle_errors)),
+        missed,
+        false,
+        len(scans) / elapsed,
+        peak_memory,
+        )
+
+
+def measure_memory(image, background, dpi, setting):
+    """Return how much, in bytes, cropping a scan adds to the peak memory
+    of a process.
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_measure_memory, args=(sender, image, background, dpi, setting)
+        )
+    _release_free_memory()
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError('The child process measuring memory failed.')
+    finally:
+        process.join()
+
+
+def _release_free_memory():
+    # Memory the parent freed but kept would be reused by the child without
+    # adding to its resident set size. Only glibc can be asked to return it.
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _measure_memory(connection, image, background, dpi, setting):
+    # A forked child starts with a peak of its current size, not that of
+    # its parent. ru_maxrss is in kilobytes on Linux.
+    start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    crop_scan(image, background, dpi, setting)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connection.send((peak - start) * 1024)
+    connection.close()
+
+
+def evaluate(scans, background, dpi, engines=('array',),
+        precisions=(10, 25, 50), contrasts=(10, 15, 25), shrinks=(0, 3, 5)):
+    """Return a Result for every combination of the settings.
+    """
+    return [
+        evaluate_setting(scans, background, dpi, Setting(*values))
+        for values in product(engines, precisions, contrasts, shrinks)
+        ]
+
+
+def pareto_front(results):
+    """Return the results that no other result beats in every respect.
+
+    A result is beaten by another that is at least as fast and accurate
+    (by mean IoU, mean angle error and the number of mistakes), and better
+    in at least one of those.
+    """
+    def scores(result):
+        return (
+            result.pages_per_second,
+            result.iou,
+            -result.angle_error,
+            -(result.missed + result.false),
+            )
+
+    front = []
+    for result in results:
+        mine = scores(result)
+        for other in results:
+            theirs = scores(other)
+            if (all(t >= m for t, m in zip(theirs, mine))
+                    and any(t > m for t, m in zip(theirs, mine))):
+                break
+        else:
+            front.append(result)
+    return front
+
+
+def fastest(results, min_iou=0.0, max_angle_error=None):
+    """Return the fastest result without mistakes that meets the
+    requirements, or None.
+    """
+    meeting = [
+        result for result in results
+        if result.missed == 0 and result.false == 0
+        and result.iou >= min_iou
+        and (max_angle_error is None
+            or result.max_angle_error <= max_angle_error)
+        ]
+    if not meeting:
+        return None
+    return max(meeting, key=lambda result: result.pages_per_second)
+
+
+def format_table(results, front=()):
+    """Return the results as a text table, fastest first.
+    """
+    lines = [
+        '  engine   precision contrast shrink    IoU  angle err  max err'
+        '  missed  false  pages/s  peak MiB'
+        ]
+    for result in sorted(results, key=lambda r: -r.pages_per_second):
+        setting = result.setting
+        lines.append(
+            '%s %-8s %9s %8s %6s  %5.3f  %9.3f  %7.3f  %6d  %5d  %7.2f  %8.1f'
+            % (
+                '*' if result in front else ' ',
+                setting.engine, setting.precision, setting.contrast,
+                setting.shrink, result.iou, result.angle_error,
+                result.max_angle_error, result.missed, result.false,
+                result.pages_per_second, result.peak_memory / 2.0 ** 20,
+                )
+            )
+    return '\n'.join(lines)
+
+
+def polygon_iou(first, second):
+    """Return the intersection over union of two convex polygons.
+    """
+    intersection = polygon_area(clip_polygon(first, second))
+    union = polygon_area(first) + polygon_area(second) - intersection
+    if union <= 0:
+        return 0.0
+    return intersection / union
+
+
+def polygon_area(points):
+    return abs(_signed_area(points))
+
+
+def _signed_area(points):
+    total = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        total += x0 * y1 - x1 * y0
+    return total / 2.0
+
+
+def clip_polygon(points, clip):
+    """Return the part of a polygon that is inside a convex polygon.
+    """
+    points = list(points)
+    clip = list(clip)
+    orientation = 1.0 if _signed_area(clip) >= 0 else -1.0
+    for (ax, ay), (bx, by) in zip(clip, clip[1:] + clip[:1]):
+        if not points:
+            break
+
+        def inside(point):
+            x, y = point
+            return ((bx - ax) * (y - ay) - (by - ay) * (x - ax)) * orientation
+
+        clipped = []
+        previous = points[-1]
+        for point in points:
+            p, q = inside(previous), inside(point)
+            if (p >= 0) != (q >= 0):
+                t = p / (p - q)
+                clipped.append((
+                    previous[0] + t * (point[0] - previous[0]),
+                    previous[1] + t * (point[1] - previous[1]),
+                    ))
+            if q >= 0:
+                clipped.append(point)
+            previous = point
+        points = clipped
+    return points
+
+
+def precision_type(value):
+    if value == 'auto':
+        return value
+    return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            'Compare the accuracy and speed of cropping settings on '
+            'synthetic scans.'
+            )
+        )
+    parser.add_argument(
+        '--scans', type=int, default=10,
+        help='The number of scans to generate (default: 10).'
+        )
+    parser.add_argument(
+        '--dpi', type=int, default=100,
+        help='The resolution of the scans (default: 100).'
+        )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The seed for generating the scans (default: 0).'
+        )
+    parser.add_argument(
+        '--noise', type=float, default=1.0,
+        help='The standard deviation of the noise in the scans (default: 1).'
+        )
+    parser.add_argument(
+        '--max-angle', type=float, default=8.0,
+        help='The largest angle, in degrees, of the photos (default: 8).'
+        )
+    parser.add_argument(
+        '--engine', nargs='+', default=['array'],
+        help='The engines to try (default: array).'
+        )
+    parser.add_argument(
+        '--precision', nargs='+', type=precision_type, default=[10, 25, 50],
+        help='The precisions to try (default: 10 25 50).'
+        )
+    parser.add_argument(
+        '--contrast', nargs='+', type=int, default=[10, 15, 25],
+        help='The contrasts to try (default: 10 15 25).'
+        )
+    parser.add_argument(
+        '--shrink', nargs='+', type=int, default=[0, 3, 5],
+        help='The shrinks to try (default: 0 3 5).'
+        )
+    parser.add_argument(
+        '--min-iou', type=float, default=0.0,
+        help='The lowest acceptable mean IoU.'
+        )
+    parser.add_argument(
+        '--max-angle-error', type=float,
+        help='The largest acceptable angle error, in degrees.'
+        )
+    options = parser.parse_args(argv)
+    if options.scans < 1:
+        parser.error('--scans must be at least 1')
+
+    scans = make_scans(
+        options.scans, options.dpi, options.max_angle, options.noise,
+        options.seed,
+        )
+    background = make_background(options.dpi, options.noise, options.seed)
+    results = evaluate(
+        scans, background, options.dpi, options.engine, options.precision,
+        options.contrast, options.shrink,
+        )
+    print(format_table(results, pareto_front(results)))
+    print('* on the Pareto front of speed and accuracy')
+
+    if options.min_iou or options.max_angle_error is not None:
+        best = fastest(results, options.min_iou, options.max_angle_error)
+        print('')
+        if best is None:
+            print('No setting meets the requirements.')
+        else:
+            print('Fastest setting that meets the requirements: '
+                'engine=%s precision=%s contrast=%s shrink=%s' % best.setting)
+
+
+if __name__ == '__main__':
+    main()
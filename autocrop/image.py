@@ -1,7 +1,9 @@
 # Copyright 2011 Michael Saavedra
 
-from .sampler import PixelSampler
-from .skew import SkewedImage
+from .engines import get_engine
+from .sampler import auto_precision
+from .section import ImageSection
+from .skew import deskew_crop
 from PIL import Image, ImageDraw
 from numpy import mean
 
@@ -10,73 +12,86 @@ class MultiPartImage(object):
     """Object for handling images that contain multiple subimages.
     
     This is used, for example, to detect and access multiple photos that were
-    scanned simultaneously in a flat-bed scanner. """
+    scanned simultaneously in a flat-bed scanner.
+    
+    The engine is the name of the detection and deskewing implementation
+    to use (see autocrop.engines), or "auto" to pick one based on the image.
+    
+    Photos are expected to be at least min_size inches on each side, and
+    anything smaller is ignored. If the precision is "auto", the lowest
+    precision that finds photos of that size which are at least min_gap
+    inches apart is used.
+    """
     def __init__(self, image, background, dpi, precision=50,
-            deskew=True, contrast=15, shrink=3):
+            deskew=True, contrast=15, shrink=3, engine='sampler',
+            min_size=1.0, min_gap=0.25):
         self.contrast = contrast
         self.image = image
         self.dpi = dpi
         self.width, self.height = image.size
+        if precision == 'auto':
+            precision = auto_precision(dpi, min_size, min_gap)
         self.precision = precision
+        self.min_area = (min_size * dpi) ** 2
         self.deskew = deskew
         self.shrink = shrink
-        self.samples = PixelSampler(image, dpi, precision)
+        self.engine = get_engine(engine, image)
         self.background = background
         self.sections = self._find_sections()
+        self._skews = None
     
     def __iter__(self):
         for section in self.sections:
-            image = self.image.crop(
-                (section.left, section.top, section.right, section.bottom)
-                )
-
-            if self.deskew:
-                skew = SkewedImage(image, self.background, self.contrast, self.shrink)
-                image, margins, angle = skew.correct()
-            else:
-                margins = (0, 0, 0, 0)
-                angle = 0
-
+            image, margins, angle = self.crop_section(section)
             self.frame_cropped_area(section, margins, angle)
-
             yield image
     
+    def crop_section(self, section):
+        """Crop (and optionally deskew) a single section of the image.
+        
+        The return value is a tuple of the cropped image, the margins that
+        were trimmed from it (left, upper, right, lower) and the angle of
+        rotation in degrees.
+        """
+        box = (section.left, section.top, section.right, section.bottom)
+        if self.deskew:
+            margins, angle = self.skews[self.sections.index(section)]
+            image = deskew_crop(self.image, box, margins, angle)
+        else:
+            image = self.image.crop(box)
+            margins = (0, 0, 0, 0)
+            angle = 0
+
+        return image, margins, angle
+    
+    @property
+    def skews(self):
+        """The margins and angle of every section, found together the first
+        time they are needed.
+        """
+        if self._skews is None:
+            self._skews = self.engine.analyze_sections(
+                self.image, self.sections, self.background, self.contrast,
+                self.shrink,
+                )
+        return self._skews
+    
     def __len__(self):
         return len(self.sections)
     
     def _find_sections(self):
-        sections = []
-        for pixel in self.samples:
-            # Skip if the sample is background or is already in a section.
-            color_data = pixel[2:]
-            location_data = pixel[:2]
-            if self.background.matches(color_data, self.contrast):
-                continue
-            if True in (location_data in section for section in sections):
-                continue
-            
-            # Find contiguous samples. This works like a 4-way flood fill, but
-            # instead of changing the color we just collect the coordinates.
-            seeds = [location_data]
-            pixels = set(seeds)
-            for seed in iter(seeds):
-                for x, y, r, g, b in self.samples.around(*seed):
-                    location = (x, y)
-                    color = (r, g, b)
-                    if location not in pixels:
-                        pixels.add(location)
-                        if not self.background.matches(color, self.contrast):
-                            seeds.append(location)
-            
-            new_section = ImageSection(pixels)
-            
-            if True in (s.merge_if_overlapping(new_section) for s in sections):
-                continue
-            
-            sections.append(new_section)
+        sections = self.engine.find_sections(
+            self.image,
+            self.background,
+            self.dpi,
+            self.precision,
+            self.contrast,
+            self.min_area,
+            )
         
-        # Filter out sections smaller than 1 square inch before returning.
-        return [s for s in sections if s > self.dpi ** 2]
+        # The engines drop areas that are too small as soon as they find
+        # them, so this only matters for engines that don't.
+        return [s for s in sections if s > self.min_area]
 
     def frame_cropped_area(self, section, margins, angle):
         rectangle = Image.new("RGBA", self.image.size, (0, 0, 0, 0))
@@ -90,83 +105,3 @@ class MultiPartImage(object):
         drawer.rectangle(xy, outline="blue", width=4)
         rectangle_rotated = rectangle.rotate(-angle, center=center)
         self.image = Image.alpha_composite(self.image.convert("RGBA"), rectangle_rotated).convert("RGB")
-
-
-class ImageSection(object):
-    """A rectangular area wholly contained within an image
-    """
-    def __init__(self, pixels):
-        """Create a new section instance.
-        
-        The dimensions will be the smallest possible that can contain the
-        provided sequence of pixels (each of which is an x, y tuple).
-        """
-        seq_x, seq_y = list(zip(*pixels))
-        self.left = min(seq_x)
-        self.right = max(seq_x)
-        self.top = min(seq_y)
-        self.bottom = max(seq_y)
-        self.height = self.bottom - self.top
-        self.width = self.right - self.left
-        self.area = self.height * self.width
-    
-    def contains(self, x, y):
-        """Returns True only if the given coordinate is inside this photo.
-        """
-        if (self.left <= x <= self.right) and (self.top <= y <= self.bottom):
-            return True
-        else:
-            return False
-    
-    def __contains__(self, pixel):
-        return self.contains(*pixel)
-    
-    def overlap(self, other):
-        """Determine the degree of overlap between this section and another.
-        
-        The return value is a float from 0 to 1.0 describing how much of the
-        smaller section is overlapping the larger one.  A value of 0 means the
-        two are non-overlapping, while 1.0 means that the smaller is completely
-        contained by the larger.
-        """
-        if self.top > other.bottom:
-            return 0.0
-        if self.bottom < other.top:
-            return 0.0
-        if self.right < other.left:
-            return 0.0
-        if self.left > other.right:
-            return 0.0
-        else:
-            height = min(self.right, other.right) - max(self.left, other.left)
-            width = min(self.bottom, other.bottom) - max(self.top, other.top)
-            overlap_area = height * width
-            smaller = min(self.height * self.width, other.height * other.width)
-            return float(overlap_area) / smaller
-    
-    def merge(self, other):
-        self.top = min(self.top, other.top)
-        self.bottom = max(self.bottom, other.bottom)
-        self.left = min(self.left, other.left)
-        self.right = max(self.right, other.right)
-        self.height = self.bottom - self.top
-        self.width = self.right - self.left
-        self.area = self.height * self.width
-    
-    def merge_if_overlapping(self, other, margin=.15):
-        """Merge the section with another if they're significantly overlapping.
-        
-        This returns True if the sections are merged, and False otherwise.
-        """
-        if self.overlap(other) >= margin:
-            self.merge(other)
-            return True
-        else:
-            return False
-    
-    def __gt__(self, minimum_area):
-        """Returns True if the area is large enough be a real photo.
-        
-        The purpose of this is to filter out things like specks of dust.
-        """
-        return self.area > minimum_area
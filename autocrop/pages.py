@@ -0,0 +1,85 @@
+# Copyright 2011 Michael Saavedra
+
+"""Streaming access to the pages of scanned images.
+
+Document feeders produce multi-page files, and a batch may be a whole
+directory of them. The functions here decode a single page at a time, so
+the memory needed stays that of a page or two no matter how many pages or
+files there are.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+# Input read from a pipe is kept in memory up to this size, and spooled to a
+# temporary file beyond it.
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def iter_pages(image):
+    """Yield (index, page) for each frame of a possibly multi-page image.
+
+    Pages are converted to RGB when needed. A page is only valid until the
+    next one is requested, since the frames share the decoder of the image.
+    Converted pages are copies, and a caller that still holds the previous
+    page when asking for the next one has both in memory at once.
+    """
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        if frame.mode == 'RGB':
+            yield index, frame
+        else:
+            yield index, frame.convert('RGB')
+
+
+def iter_files(names, stdin=None):
+    """Yield (name, file) for each image file in the given list of names.
+
+    Directories are walked recursively in sorted order, skipping files whose
+    extension isn't that of a format PIL can open, and the files in them are
+    named by their path relative to the directory. The name '-' stands for standard input, which
+    is spooled into a seekable file because the image decoders need to seek.
+    """
+    extensions = {
+        extension
+        for extension, format in Image.registered_extensions().items()
+        if format in Image.OPEN
+        }
+    for name in names:
+        if name == '-':
+            if stdin is None:
+                stdin = sys.stdin.buffer
+            with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as f:
+                shutil.copyfileobj(stdin, f)
+                f.seek(0)
+                yield 'stdin', f
+        elif os.path.isdir(name):
+            for root, dirs, files in os.walk(name):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if os.path.splitext(file_name)[1].lower() in extensions:
+                        path = os.path.join(root, file_name)
+                        yield os.path.relpath(path, name), path
+        else:
+            yield os.path.basename(name), name
+
+
+def iter_scans(names, stdin=None):
+    """Yield (name, index, page) for every page of every image in names.
+
+    See iter_files() for the names that are accepted. A file found in a
+    directory that can't be decoded is reported on stderr and skipped, but
+    the files that were named directly must all be images.
+    """
+    for name, source in iter_files(names, stdin):
+        try:
+            with Image.open(source) as image:
+                for index, page in iter_pages(image):
+                    yield name, index, page
+        except (UnidentifiedImageError, OSError) as e:
+            if not isinstance(source, str) or source in names:
+                raise
+            sys.stderr.write(f'Skipping {source}: {e}\n')
@@ -1,30 +1,81 @@
 # Copyright 2011 Michael Saavedra
 
 
+from math import ceil
+
+
 class ReachedEdge(StopIteration):
     pass
 
 
+def auto_precision(dpi, min_size=1.0, min_gap=0.25, samples=4):
+    """Return the lowest precision that reliably finds every photo.
+    
+    The photos are at least min_size inches on their shortest side, and at
+    least min_gap inches apart. The sample step is chosen so each photo is
+    crossed by the given number of samples, and so that background samples
+    always fall between neighbouring photos, which keeps their sections from
+    running into each other. Sections are only as tight as the sample step,
+    so this works best when the photos are deskewed, which trims the margins.
+    """
+    if dpi < 1:
+        raise ValueError('The dpi must be at least 1, not %r' % dpi)
+    step = min(min_size * dpi / samples, min_gap * dpi / 2)
+    step = max(int(step), 1)
+    # Round up, so the step PixelSampler derives is never larger.
+    return min(int(ceil(dpi / step)), dpi)
+
+
+class ArrayPixels(object):
+    """Pixel access to a numpy array, like the object Image.load() returns.
+    
+    This lets a sampler read from a view of part of a larger image without
+    copying it.
+    """
+    def __init__(self, array):
+        self.array = array
+    
+    def __getitem__(self, location):
+        x, y = location
+        return self.array[int(y), int(x)].tolist()
+
+
 class PixelSampler(object):
     """An iterator to collect regularly spaced pixel samples from an image.
     
-    It also has methods to get samples adjacent to a particular point.
+    It also has methods to get samples adjacent to a particular point. The
+    image is either a PIL image or a numpy array of RGB rows.
     """
     def __init__(self, image, dpi, precision=50):
-        self.image = image
-        self.width, self.height = image.size
-        self.data = image.load()
+        self.update_image(image)
         self.dpi = dpi
+        self.precision = self.limit_precision(dpi, precision)
+        self.step = self.get_step(dpi, precision)
+    
+    @staticmethod
+    def limit_precision(dpi, precision):
         if precision > dpi:
             # A sampler step smaller than one pixel is impossible
-            self.precision = dpi
+            return dpi
         elif precision == 0:
             # We want to avoid division-by-zero errors.
-            self.precision = 1
+            return 1
         else:
-            self.precision = precision
+            return precision
+    
+    @classmethod
+    def get_step(cls, dpi, precision):
+        """Return the distance in pixels between samples.
         
-        self.step = int(self.dpi / self.precision)
+        A ValueError is raised if the dpi or precision would give a step of
+        less than one pixel.
+        """
+        if dpi < 1:
+            raise ValueError('The dpi must be at least 1, not %r' % dpi)
+        step = int(dpi / cls.limit_precision(dpi, precision))
+        if step < 1:
+            raise ValueError('The precision must be positive, not %r' % precision)
+        return step
     
     def __iter__(self):
         for x, y, _, _, _ in self.run(self.down, self.step, self.step):
@@ -33,7 +84,12 @@ class PixelSampler(object):
     
     def update_image(self, image):
         self.image = image
-        self.data = image.load()
+        if hasattr(image, 'load'):
+            self.width, self.height = image.size
+            self.data = image.load()
+        else:
+            self.height, self.width = image.shape[:2]
+            self.data = ArrayPixels(image)
     
     def run(self, direction, x, y, distance=0, maximum=0):
         if distance == 0:
@@ -102,8 +158,26 @@ class PixelSampler(object):
         return (x, y, red, green, blue)
     
     def around(self, x, y, distance=0):
+        """Yield the samples above, right of, below and left of a sample.
+        
+        The last column and row of samples may be closer than the distance
+        to the ones before them, so stepping back from them would land
+        between the columns or rows that iteration visits. The samples
+        before them on the grid are returned instead.
+        """
+        if distance == 0:
+            distance = self.step
         for f in (self.up, self.right, self.down, self.left):
             try:
-                yield f(x, y, distance)
+                result = f(x, y, distance)
             except ReachedEdge:
                 continue
+            if f == self.left and x == self.width - distance - 1:
+                result = self.sample((x - 1) // distance * distance, y)
+            elif f == self.up and y == self.height - distance - 1:
+                result = self.sample(x, (y - 1) // distance * distance)
+            yield result
+    
+    def sample(self, x, y):
+        red, green, blue = self.data[x, y][:3]
+        return (x, y, red, green, blue)
@@ -0,0 +1,81 @@
+# Copyright 2011 Michael Saavedra
+
+
+class ImageSection(object):
+    """A rectangular area wholly contained within an image
+    """
+    def __init__(self, pixels):
+        """Create a new section instance.
+        
+        The dimensions will be the smallest possible that can contain the
+        provided sequence of pixels (each of which is an x, y tuple).
+        """
+        seq_x, seq_y = list(zip(*pixels))
+        self.left = min(seq_x)
+        self.right = max(seq_x)
+        self.top = min(seq_y)
+        self.bottom = max(seq_y)
+        self.height = self.bottom - self.top
+        self.width = self.right - self.left
+        self.area = self.height * self.width
+    
+    def contains(self, x, y):
+        """Returns True only if the given coordinate is inside this photo.
+        """
+        if (self.left <= x <= self.right) and (self.top <= y <= self.bottom):
+            return True
+        else:
+            return False
+    
+    def __contains__(self, pixel):
+        return self.contains(*pixel)
+    
+    def overlap(self, other):
+        """Determine the degree of overlap between this section and another.
+        
+        The return value is a float from 0 to 1.0 describing how much of the
+        smaller section is overlapping the larger one.  A value of 0 means the
+        two are non-overlapping, while 1.0 means that the smaller is completely
+        contained by the larger.
+        """
+        if self.top > other.bottom:
+            return 0.0
+        if self.bottom < other.top:
+            return 0.0
+        if self.right < other.left:
+            return 0.0
+        if self.left > other.right:
+            return 0.0
+        else:
+            height = min(self.right, other.right) - max(self.left, other.left)
+            width = min(self.bottom, other.bottom) - max(self.top, other.top)
+            overlap_area = height * width
+            smaller = min(self.height * self.width, other.height * other.width)
+            return float(overlap_area) / smaller
+    
+    def merge(self, other):
+        self.top = min(self.top, other.top)
+        self.bottom = max(self.bottom, other.bottom)
+        self.left = min(self.left, other.left)
+        self.right = max(self.right, other.right)
+        self.height = self.bottom - self.top
+        self.width = self.right - self.left
+        self.area = self.height * self.width
+    
+    def merge_if_overlapping(self, other, margin=.15):
+        """Merge the section with another if they're significantly overlapping.
+        
+        This returns True if the sections are merged, and False otherwise.
+        """
+        if self.overlap(other) >= margin:
+            self.merge(other)
+            return True
+        else:
+            return False
+    
+    def __gt__(self, minimum_area):
+        """Returns True if the area is large enough be a real photo.
+        
+        The purpose of this is to filter out things like specks of dust.
+        """
+        return self.area > minimum_area
@@ -0,0 +1,356 @@
+# Copyright 2011 Michael Saavedra
+
+"""A long-running local crop service.
+
+The service listens on a localhost HTTP port and keeps a pool of worker
+processes warm, so the cost of starting python, importing numpy and PIL and
+loading the background records is paid once instead of once per scan.
+
+Endpoints:
+
+    POST /crop   Crop the image in the request body, or the image at the
+                 path given in the ``path`` query parameter. The response is
+                 a JSON object with a ``sections`` list, each entry having the
+                 ``page`` it was found on (multi-page images are cropped page
+                 by page), the ``box`` of the section, the ``margins``
+                 trimmed while deskewing, the ``angle`` of rotation and (unless
+                 ``geometry=1`` is given) the base64 encoded ``image``.
+                 If a crop worker dies the workers are restarted, and a 503
+                 response is only given if the retry fails as well.
+    GET /stats   Queue depth and latency counters as a JSON object.
+
+The ``scanner``, ``dpi``, ``precision``, ``deskew``, ``contrast``, ``shrink``,
+``filetype``, ``engine``, ``min_size`` and ``min_gap`` query parameters
+override the server defaults for a single request. The server speaks
+HTTP/1.1, so clients may keep a connection open and pipeline several
+requests on it.
+"""
+
+import base64
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+from .background import Background
+from .engines import ENGINES
+from .image import MultiPartImage
+from .pages import iter_pages
+from .session import CropSession
+
+DEFAULTS = {
+    'scanner': '',
+    'dpi': 300,
+    'precision': 50,
+    'deskew': True,
+    'contrast': 15,
+    'shrink': 3,
+    'filetype': 'png',
+    'engine': 'sampler',
+    'min_size': 1.0,
+    'min_gap': 0.25,
+    'geometry': False,
+    }
+
+FORMATS = {'png': 'PNG', 'jpg': 'JPEG'}
+
+# Background objects for each scanner, built once per worker process.
+_backgrounds = {}
+
+# Crop sessions for each combination of settings used by a worker process.
+_sessions = {}
+MAX_SESSIONS = 16
+
+
+def _init_worker(bg_records):
+    for name, (medians, std_devs) in bg_records.items():
+        _backgrounds[name] = Background(medians, std_devs)
+
+
+def get_session(scanner, *settings):
+    key = (scanner,) + settings
+    if key not in _sessions:
+        if len(_sessions) >= MAX_SESSIONS:
+            _sessions.clear()
+        background = _backgrounds.get(scanner) or Background()
+        _sessions[key] = CropSession(background, *settings)
+    return _sessions[key]
+
+
+def crop_image(source, scanner='', dpi=300, precision=50, deskew=True,
+        contrast=15, shrink=3, filetype='png', engine='sampler', min_size=1.0,
+        min_gap=0.25, geometry=False):
+    """Find and crop the sections of an image.
+
+    The source is either the encoded image data or a path to an image file.
+    This runs inside a worker process, so it only takes and returns plain,
+    picklable values. Unless the sampler engine is asked for, a CropSession
+    is kept for each combination of settings, so the buffers of one scan are
+    reused for the next.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    background = _backgrounds.get(scanner) or Background()
+    sections = []
+    with Image.open(source) as image:
+        for index, page in iter_pages(image):
+            if engine == 'sampler':
+                multipart_image = MultiPartImage(
+                    page, background, dpi, precision, deskew, contrast, shrink,
+                    engine, min_size, min_gap
+                    )
+                crops = (
+                    (section,) + multipart_image.crop_section(section)
+                    for section in multipart_image.sections
+                    )
+            else:
+                session = get_session(
+                    scanner, dpi, precision, deskew, contrast, shrink,
+                    min_size, min_gap
+                    )
+                crops = session.crops(page)
+            for section, crop, margins, angle in crops:
+                entry = {
+                    'page': index,
+                    'box': [section.left, section.top, section.right, section.bottom],
+                    'margins': [int(v) for v in margins],
+                    'angle': float(angle),
+                    }
+                if not geometry:
+                    buf = BytesIO()
+                    crop.save(buf, format=FORMATS[filetype])
+                    entry['image'] = base64.b64encode(buf.getvalue()).decode('ascii')
+                sections.append(entry)
+    return sections
+
+
+class Stats(object):
+    """Thread-safe queue depth and latency counters.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def start(self):
+        with self.lock:
+            self.pending += 1
+        return time.monotonic()
+
+    def finish(self, started, failed=False):
+        latency = time.monotonic() - started
+        with self.lock:
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.last_latency = latency
+        return latency
+
+    def as_dict(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                'pending': self.pending,
+                'completed': self.completed,
+                'failed': self.failed,
+                'mean_latency': self.total_latency / finished if finished else 0.0,
+                'max_latency': self.max_latency,
+                'last_latency': self.last_latency,
+                }
+
+
+class CropRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/stats':
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        stats = self.server.stats.as_dict()
+        stats['workers'] = self.server.workers
+        self._send_json(200, stats)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # The end of the body is unknown, so the connection can't be
+            # used for another request.
+            self.close_connection = True
+            self._send_json(400, {'error': 'Invalid Content-Length.'})
+            return
+        body = self.rfile.read(length)
+        if url.path != '/crop':
+            self._send_json(404, {'error': 'Not found.'})
+            return
+
+        query = parse_qs(url.query)
+        try:
+            params = self.server.get_params(query)
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {'error': 'Invalid parameter: %s' % e})
+            return
+        if 'path' in query:
+            source = query['path'][0]
+        elif body:
+            source = body
+        else:
+            self._send_json(400, {'error': 'No image given.'})
+            return
+
+        stats = self.server.stats
+        started = stats.start()
+        try:
+            sections = self.server.crop(source, params)
+        except BrokenProcessPool:
+            stats.finish(started, failed=True)
+            self._send_json(503, {'error': 'A crop worker died.'})
+            return
+        except Exception as e:
+            stats.finish(started, failed=True)
+            self._send_json(500, {'error': str(e)})
+            return
+        latency = stats.finish(started)
+        self._send_json(200, {'sections': sections, 'latency': latency})
+
+    def _send_json(self, status, data):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class CropServer(ThreadingHTTPServer):
+    """An HTTP server that hands crop requests to a warm process pool.
+
+    The background records are a mapping of scanner names to (medians,
+    std_devs) pairs, as stored in backgrounds.json. Requests may only name
+    one of those scanners, or the default one.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), bg_records=None,
+            workers=None, defaults=None, quiet=False):
+        super().__init__(address, CropRequestHandler)
+        self.defaults = dict(DEFAULTS)
+        self.defaults.update(defaults or {})
+        self.quiet = quiet
+        self.stats = Stats()
+        self.scanners = set(bg_records or {})
+        self.workers = workers or os.cpu_count() or 1
+        self.bg_records = bg_records or {}
+        self.pool_lock = threading.Lock()
+        self.pool = self.start_pool()
+
+    def start_pool(self):
+        """Start a pool of workers with the background records loaded.
+        """
+        pool = ProcessPoolExecutor(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(self.bg_records,),
+            )
+        # Start the workers now, rather than on the first request.
+        for future in [pool.submit(int) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def crop(self, source, params):
+        """Crop an image in the pool, and return its sections.
+
+        If a worker dies, which breaks the whole pool, the pool is replaced
+        and the image is tried once more. BrokenProcessPool is raised if
+        that fails too.
+        """
+        for attempt in range(2):
+            pool = self.pool
+            try:
+                return pool.submit(crop_image, source, **params).result()
+            except BrokenProcessPool:
+                with self.pool_lock:
+                    # Another request may have replaced the pool already.
+                    if self.pool is pool:
+                        pool.shutdown(wait=False)
+                        self.pool = self.start_pool()
+                if attempt:
+                    raise
+
+    def get_params(self, query):
+        """Merge the query parameters of a request with the defaults.
+        """
+        params = dict(self.defaults)
+        for name, values in query.items():
+            if name == 'path':
+                continue
+            default = DEFAULTS[name]
+            value = values[0]
+            if isinstance(default, bool):
+                params[name] = value.lower() in ('1', 'true', 'yes')
+            elif isinstance(default, float):
+                params[name] = float(value)
+            elif name == 'precision' and value == 'auto':
+                params[name] = value
+            elif isinstance(default, int):
+                params[name] = int(value)
+            else:
+                params[name] = value
+        if params['filetype'] not in FORMATS:
+            raise ValueError('filetype')
+        if params['dpi'] < 1:
+            raise ValueError('dpi')
+        if params['precision'] != 'auto' and params['precision'] < 1:
+            raise ValueError('precision')
+        if params['min_size'] <= 0:
+            raise ValueError('min_size')
+        if params['min_gap'] <= 0:
+            raise ValueError('min_gap')
+        if params['engine'] != 'auto' and params['engine'] not in ENGINES:
+            raise ValueError('engine')
+        # Only the default scanner may be used without a background record.
+        if (params['scanner'] != self.defaults['scanner']
+                and params['scanner'] not in self.scanners):
+            raise ValueError('unknown scanner %r' % params['scanner'])
+        return params
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+def serve(port, bg_records=None, workers=None, defaults=None):
+    """Run a crop server on a localhost port until interrupted.
+    """
+    server = CropServer(('127.0.0.1', port), bg_records, workers, defaults)
+    host, port = server.server_address[:2]
+    print('Serving on http://%s:%d with %d workers' % (host, port, server.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
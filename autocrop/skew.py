@@ -1,22 +1,31 @@
 # Copyright 2011 Michael Saavedra
 
-from math import atan2, degrees
+from math import atan2, cos, degrees, radians, sin
 
 import numpy
-from PIL.Image import BICUBIC
+from PIL.Image import AFFINE, BICUBIC
 
 from .sampler import PixelSampler
 
+# The number of samples at the start of each scanline that analyze_sections()
+# reads before falling back to whole scanlines.
+SCANLINE_WINDOW = 32
+
 
 class SkewedImage(object):
+    """Find and correct the rotation of a single photo.
     
+    The image is either a PIL image or a numpy array of RGB rows, such as a
+    view of one section of a larger scan. Only PIL images can be corrected,
+    but the margins and angle of both can be found with analyze().
+    """
     def __init__(self, image, background, contrast=10, shrink=0):
         self.image = image
-        self.width, self.height = image.size
         self.background = background
         self.contrast = contrast
         self.shrink = shrink
         sampler = PixelSampler(image, dpi=1, precision=1)
+        self.width, self.height = sampler.width, sampler.height
         self.sides = (
             Left(sampler),
             Top(sampler),
@@ -25,17 +34,24 @@ class SkewedImage(object):
             )
     
     def correct(self):
+        shrunk_margins, angle = self.analyze()
+        rotated_img = self.image.rotate(angle, BICUBIC)
+        return rotated_img.crop(shrunk_margins), shrunk_margins, angle
+    
+    def analyze(self):
+        """Return the margins (left, upper, right, lower) of the photo once
+        it is rotated, and the angle of rotation in degrees.
+        """
         margins, angles = list(
             zip(*[self._get_margin(side) for side in self.sides])
             )
 
         angle = degrees(numpy.median(angles))
-        rotated_img = self.image.rotate(angle, BICUBIC)
 
         # margins: (left, upper, right, lower)
         shrunk_margins = tuple(v + self.shrink for v in margins[0:2]) + tuple(v - self.shrink for v in margins[2:4])
 
-        return rotated_img.crop(shrunk_margins), shrunk_margins, angle
+        return shrunk_margins, angle
     
     def _get_margin(self, side):
         """Find the distance and angle of the margin on a particular side.
@@ -69,6 +85,154 @@ class SkewedImage(object):
         return int(numpy.median(distances)), numpy.median(angles)
 
 
+def analyze_sections(pixels, boxes, background, contrast=10, shrink=0):
+    """Find the margins and angles of many photos in a scan at once.
+    
+    The pixels are a numpy array of the whole scan, and the boxes are the
+    (left, upper, right, lower) boxes of the photos in it. The result is a
+    list of (margins, angle) pairs, the same as SkewedImage.analyze() gives
+    for each box, but the scanlines of every side of every photo are read
+    from the scan together, in one gather for the start of every scanline
+    and one more for the rest of those that need it, and are searched for
+    their margins together.
+    """
+    lower, upper = background.thresholds(contrast)
+    sides = (Left, Top, Right, Bottom)
+    lines = []
+    sizes = []
+    for left, top, right, bottom in boxes:
+        width = right - left
+        height = bottom - top
+        for side in sides:
+            side_lines = side.get_scanlines(left, top, width, height)
+            lines.extend(side_lines)
+            sizes.append(len(side_lines))
+    if not lines:
+        return []
+    (row0, col0, row_step, col_step, count, distance0, distance_step,
+        step, sign) = [numpy.array(values) for values in zip(*lines)]
+
+    # Most margins are close to the edge of the box, so only the start of
+    # each scanline is read at first, and the whole of the few scanlines
+    # where that isn't enough.
+    margin_distances = numpy.empty(len(lines), dtype=int)
+    todo = numpy.arange(len(lines))
+    for length in (min(SCANLINE_WINDOW, count.max()), count.max()):
+        lines_todo = (
+            row0[todo], col0[todo], row_step[todo], col_step[todo], count[todo],
+            distance0[todo], distance_step[todo], step[todo],
+            )
+        distances, done = _find_margins(pixels, lower, upper, length, *lines_todo)
+        margin_distances[todo[done]] = distances[done]
+        todo = todo[~done]
+        if not len(todo):
+            break
+
+    # The angle between each scanline and the one before it; only the pairs
+    # on the same side are used.
+    angles = numpy.arctan2(
+        sign[1:] * (margin_distances[1:] - margin_distances[:-1]), step[1:]
+        )
+
+    # The medians of the sides, grouped by their number of scanlines.
+    sizes = numpy.array(sizes)
+    offsets = numpy.cumsum(sizes) - sizes
+    side_margins = numpy.zeros(len(sizes), dtype=int)
+    side_angles = numpy.full(len(sizes), numpy.nan)
+    for size in numpy.unique(sizes):
+        group = numpy.flatnonzero(sizes == size)
+        side_margins[group] = numpy.median(
+            margin_distances[offsets[group, None] + numpy.arange(size)], axis=1
+            ).astype(int)
+        if size > 1:
+            side_angles[group] = numpy.median(
+                angles[offsets[group, None] + numpy.arange(size - 1)], axis=1
+                )
+    side_margins = side_margins.reshape(-1, len(sides))
+    box_angles = numpy.degrees(
+        numpy.median(side_angles.reshape(-1, len(sides)), axis=1)
+        )
+
+    results = []
+    for (left, top, right, bottom), angle in zip(side_margins.tolist(), box_angles.tolist()):
+        margins = (left + shrink, top + shrink, right - shrink, bottom - shrink)
+        results.append((margins, angle))
+    return results
+
+
+def _find_margins(pixels, lower, upper, length, row0, col0, row_step,
+        col_step, count, distance0, distance_step, step):
+    """Search the first length samples of scanlines for the margin.
+    
+    This follows SkewedImage._get_margin(). The return value is the distance
+    of the margin on each scanline, and whether it could be decided from the
+    samples that were read.
+    """
+    index = numpy.arange(length)
+    valid = index < count[:, None]
+    rows = numpy.where(valid, row0[:, None] + row_step[:, None] * index, row0[:, None])
+    cols = numpy.where(valid, col0[:, None] + col_step[:, None] * index, col0[:, None])
+    samples = pixels[rows, cols, :3]
+    background_samples = numpy.all(
+        (samples >= lower) & (samples <= upper), axis=2
+        )
+    distances = distance0[:, None] + distance_step[:, None] * index
+    line_index = numpy.arange(len(row0))
+
+    # First try to find any shadows along the image border. Stop at the first
+    # background sample, or start over if we go too far.
+    stops = valid & (background_samples | (distances > step[:, None]))
+    found = stops.any(axis=1)
+    first = stops.argmax(axis=1)
+    start = numpy.where(found & background_samples[line_index, first], first + 1, 0)
+
+    # Next try to find any remaining background. If none is found, the last
+    # sample of the scanline is used.
+    edges = valid & ~background_samples & (index >= start[:, None])
+    found_edge = found & edges.any(axis=1)
+    edge = numpy.where(found_edge, edges.argmax(axis=1), count - 1)
+    edge_distances = distance0 + distance_step * edge
+    done = found_edge | (count <= length)
+    return edge_distances, done
+
+
+def deskew_crop(image, box, margins, angle, resample=BICUBIC):
+    """Cut a deskewed photo straight out of a larger image.
+    
+    This is equivalent to cropping the box (left, upper, right, lower) from
+    the image, rotating the result by angle degrees about its center and
+    cropping the margins from that, as SkewedImage.correct() does. Combining
+    the three steps into one affine transform avoids the two intermediate
+    images. Near the edges of the box, pixels from outside of it are used
+    instead of the black fill of a rotation.
+    """
+    size = (margins[2] - margins[0], margins[3] - margins[1])
+    matrix = deskew_matrix(box, margins, angle)
+    return image.transform(size, AFFINE, matrix, resample)
+
+
+def deskew_matrix(box, margins, angle):
+    """Return the affine transform used by deskew_crop().
+    
+    The six coefficients map a position (x, y) in the deskewed photo to
+    (a*x + b*y + c, d*x + e*y + f) in the larger image.
+    """
+    left, top, right, bottom = box
+    center_x = (right - left) / 2.0
+    center_y = (bottom - top) / 2.0
+    # Like Image.rotate(), map each output pixel back to the source.
+    a = -radians(angle)
+    matrix = [
+        round(cos(a), 15), round(sin(a), 15), 0.0,
+        round(-sin(a), 15), round(cos(a), 15), 0.0,
+        ]
+    margin_x = margins[0] - center_x
+    margin_y = margins[1] - center_y
+    matrix[2] = matrix[0] * margin_x + matrix[1] * margin_y + center_x + left
+    matrix[5] = matrix[3] * margin_x + matrix[4] * margin_y + center_y + top
+    return matrix
+
+
 class Top(object):
     
     precision = 6
@@ -95,6 +259,22 @@ class Top(object):
     
     def get_angle(self, prev_distance, x, y):
         return atan2(y - prev_distance, self.step)
+    
+    @classmethod
+    def get_scanlines(cls, left, top, width, height):
+        """Describe the scanlines of this side of the photo in the given box.
+        
+        Each is a tuple of the first row and column in the scan, the row and
+        column increments, the number of samples, the distance of the first
+        sample and its increment, the spacing of the scanlines and the sign
+        of the angle between two scanlines. They are the same lines that
+        run_parallel() and run_perpendicular() follow.
+        """
+        step = width / cls.precision
+        return [
+            (top, left + int(x), 1, 0, height - 1, 0, 1, step, 1)
+            for x in _forward(step, step, width, cls.count)
+            ]
 
 
 class Right(Top):
@@ -112,6 +292,14 @@ class Right(Top):
     
     def get_angle(self, prev_distance, x, y):
         return atan2(prev_distance - x, self.step)
+    
+    @classmethod
+    def get_scanlines(cls, left, top, width, height):
+        step = height / cls.precision
+        return [
+            (top + int(y), left + width - 1, 0, -1, width - 1, width - 1, -1, step, -1)
+            for y in _forward(step, step, height, cls.count)
+            ]
 
 
 class Bottom(Top):
@@ -129,6 +317,14 @@ class Bottom(Top):
     
     def get_angle(self, prev_distance, x, y):
         return atan2(prev_distance - y, self.step)
+    
+    @classmethod
+    def get_scanlines(cls, left, top, width, height):
+        step = width / cls.precision
+        return [
+            (top + height - 1, left + int(x), -1, 0, height - 1, height - 1, -1, step, -1)
+            for x in _backward(width - step, step, cls.count)
+            ]
 
 
 class Left(Top):
@@ -146,3 +342,28 @@ class Left(Top):
         
     def get_angle(self, prev_distance, x, y):
         return atan2(x - prev_distance, self.step)
+    
+    @classmethod
+    def get_scanlines(cls, left, top, width, height):
+        step = height / cls.precision
+        return [
+            (top + int(y), left, 0, 1, width - 1, 0, 1, step, 1)
+            for y in _backward(height - step, step, cls.count)
+            ]
+
+
+def _forward(start, step, length, count):
+    # The positions PixelSampler.right() and down() step through.
+    positions = [start]
+    maximum = length - step - 1
+    while len(positions) <= count and positions[-1] != maximum:
+        positions.append(min(positions[-1] + step, maximum))
+    return positions
+
+
+def _backward(start, step, count):
+    # The positions PixelSampler.left() and up() step through.
+    positions = [start]
+    while len(positions) <= count and positions[-1] != step:
+        positions.append(max(positions[-1] - step, step))
+    return positions
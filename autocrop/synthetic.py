@@ -0,0 +1,67 @@
+# Copyright 2011 Michael Saavedra
+
+"""Synthetic scans of photos with known positions and angles.
+
+These are used to check detection and deskewing against the exact answer,
+instead of against measurements taken by hand from real scans.
+"""
+
+from collections import namedtuple
+from math import cos, radians, sin
+
+import numpy
+from PIL import Image, ImageDraw
+
+# The bounding box (left, top, right, bottom) of a photo on the scan, its
+# size before rotation, the angle that autocrop should report for it and the
+# positions of its corners.
+Label = namedtuple('Label', ('box', 'size', 'angle', 'corners'))
+
+
+def make_scan(photos, size=(850, 1100), background=(245, 245, 245),
+        noise=1.0, seed=0):
+    """Draw photos on a blank scan, and return the image and its labels.
+
+    Each photo is a (center_x, center_y, width, height, angle) tuple, with
+    the angle in degrees. A positive angle is a photo turned clockwise, which
+    is corrected by rotating it counter-clockwise by the same angle. The
+    photos are filled with random, darker than background colors, and
+    gaussian noise with the given standard deviation is added to everything.
+    """
+    random = numpy.random.RandomState(seed)
+    image = Image.new('RGB', size, background)
+    drawer = ImageDraw.Draw(image)
+    labels = []
+    for center_x, center_y, width, height, angle in photos:
+        corners = get_corners(center_x, center_y, width, height, angle)
+        color = tuple(int(v) for v in random.randint(20, 200, 3))
+        drawer.polygon(corners, fill=color)
+        xs, ys = list(zip(*corners))
+        box = (
+            int(round(min(xs))),
+            int(round(min(ys))),
+            int(round(max(xs))),
+            int(round(max(ys))),
+            )
+        labels.append(Label(box, (width, height), angle, corners))
+
+    if noise:
+        pixels = numpy.asarray(image, dtype=numpy.float64)
+        pixels = pixels + random.normal(0, noise, pixels.shape)
+        image = Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8))
+    return image, labels
+
+
+def get_corners(center_x, center_y, width, height, angle):
+    """Return the corners of a rectangle turned clockwise by angle degrees.
+    """
+    a = radians(angle)
+    corners = []
+    for x, y in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+        x = x * width / 2.0
+        y = y * height / 2.0
+        corners.append((
+            center_x + x * cos(a) - y * sin(a),
+            center_y + x * sin(a) + y * cos(a),
+            ))
+    return corners
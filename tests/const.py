@@ -8,3 +8,6 @@ while os.path.islink(_file_name):
     _file_name = os.path.abspath(os.readlink(_file_name))
 
 IMAGE_PATH = os.path.join(os.path.split(_file_name)[0], 'images')
+SCRIPT_PATH = os.path.join(
+    os.path.dirname(os.path.split(_file_name)[0]), 'autocrop.py'
+    )
@@ -0,0 +1,132 @@
+import asyncio
+from io import BytesIO
+import os
+import threading
+import time
+import unittest
+
+from PIL import Image
+
+from autocrop import Background
+from autocrop import aio
+from tests.const import IMAGE_PATH
+
+OPTIONS = {'dpi': 72, 'precision': 4, 'deskew': False}
+
+
+class TestAsyncCrop(unittest.TestCase):
+    
+    def setUp(self):
+        self.path = os.path.join(IMAGE_PATH, '72-dpi-4-images.jpg')
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        self.executor = aio.CropExecutor(max_workers=2, max_pending=1)
+    
+    def tearDown(self):
+        self.executor.shutdown()
+    
+    def test_crop(self):
+        photos = asyncio.run(aio.crop(
+            self.data, Background(), executor=self.executor, **OPTIONS
+            ))
+        self.assertEqual(len(photos), 4)
+        self.assertEqual(Image.open(BytesIO(photos[0])).format, 'PNG')
+        
+        async def collect():
+            return [photo async for photo in aio.iter_crops(
+                self.path, Background(), format=None, executor=self.executor,
+                **OPTIONS
+                )]
+        sizes = [photo.size for photo in asyncio.run(collect())]
+        self.assertEqual(sizes, [Image.open(BytesIO(p)).size for p in photos])
+    
+    def test_responsive(self):
+        async def main():
+            ticks = []
+            
+            async def ticker():
+                while True:
+                    ticks.append(time.monotonic())
+                    await asyncio.sleep(0.001)
+            
+            task = asyncio.ensure_future(ticker())
+            await aio.crop(
+                self.data, Background(), executor=self.executor, **OPTIONS
+                )
+            task.cancel()
+            return ticks
+        
+        # The loop keeps running while the scan is cropped.
+        self.assertGreater(len(asyncio.run(main())), 1)
+    
+    def test_backpressure(self):
+        async def main():
+            first = asyncio.ensure_future(aio.crop(
+                self.data, Background(), executor=self.executor, **OPTIONS
+                ))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(aio.crop(
+                self.data, Background(), executor=self.executor, **OPTIONS
+                ))
+            await asyncio.sleep(0)
+            # Only one scan may be in progress; the other must wait.
+            self.assertEqual(self.executor.pending, 1)
+            return await asyncio.gather(first, second)
+        
+        first, second = asyncio.run(main())
+        self.assertEqual(len(first), 4)
+        self.assertEqual(first, second)
+        self.assertEqual(self.executor.pending, 0)
+    
+    def test_cancel(self):
+        async def main():
+            received = []
+            
+            async def consume():
+                photos = aio.iter_crops(
+                    self.data, Background(), executor=self.executor, **OPTIONS
+                    )
+                try:
+                    async for photo in photos:
+                        received.append(photo)
+                        await asyncio.sleep(10)
+                finally:
+                    await photos.aclose()
+            
+            task = asyncio.ensure_future(consume())
+            while not received:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The slot is free again for the next scan.
+            self.assertEqual(self.executor.pending, 0)
+            photos = await aio.crop(
+                self.data, Background(), executor=self.executor, **OPTIONS
+                )
+            return received, photos
+        
+        received, photos = asyncio.run(main())
+        self.assertEqual(len(received), 1)
+        self.assertEqual(len(photos), 4)
+    
+    def test_cancel_waits_for_worker(self):
+        async def main():
+            started = threading.Event()
+            finished = []
+            
+            def work():
+                started.set()
+                time.sleep(0.2)
+                finished.append(True)
+            
+            task = asyncio.ensure_future(self.executor.run(work))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The work was done before the cancellation went through.
+            return finished
+        
+        self.assertEqual(asyncio.run(main()), [True])
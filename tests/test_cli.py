@@ -0,0 +1,336 @@
+import contextlib
+import importlib.util
+import io
+import os
+import shutil
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from argparse import Namespace
+
+from PIL import Image
+
+from autocrop import Background
+
+from tests.const import IMAGE_PATH, SCRIPT_PATH
+
+HEAVY_MODULES = ('numpy', 'PIL', 'simple_config', 'autocrop')
+
+# The most time, in seconds, that --help and --list may take to start.
+STARTUP_LIMIT = 0.5
+
+HAVE_SIMPLE_CONFIG = importlib.util.find_spec('simple_config') is not None
+
+# Stands in for simple_config where it isn't installed; only its import is
+# being checked.
+SIMPLE_CONFIG_STUB = (
+    'class Config(object):\n'
+    '    def __init__(self, file_name, defaults):\n'
+    '        self.__dict__.update(defaults)\n'
+    )
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('autocrop_cli', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Worker processes find the functions they run by module name.
+    sys.modules['autocrop_cli'] = module
+    return module
+
+
+def make_stub(bin_dir, script):
+    path = os.path.join(bin_dir, 'scanimage')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n' + script)
+    os.chmod(path, stat.S_IRWXU)
+
+
+class TestStartup(unittest.TestCase):
+    """Guard against start-up regressions by checking which modules the
+    command-line script pulls in before it has real work to do, and how long
+    it takes to start.
+    """
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.env = dict(os.environ, XDG_DATA_HOME=self.home)
+        self.tmp = tempfile.mkdtemp()
+        if not HAVE_SIMPLE_CONFIG:
+            with open(os.path.join(self.tmp, 'simple_config.py'), 'w') as f:
+                f.write(SIMPLE_CONFIG_STUB)
+            self.env['PYTHONPATH'] = os.pathsep.join(
+                [self.tmp] + sys.path
+                )
+        make_stub(
+            self.tmp,
+            'echo "device \\`test:0\' is a Test flatbed scanner"\n'
+            )
+        self.env['PATH'] = self.tmp + os.pathsep + os.environ['PATH']
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+        shutil.rmtree(self.tmp)
+
+    def get_loaded_modules(self, *args):
+        """Run the script with the given arguments in a fresh interpreter and
+        return the heavy modules it imported. Without arguments the script is
+        only imported.
+        """
+        code = (
+            'import runpy, sys\n'
+            'sys.argv = [%r] + %r\n'
+            'try:\n'
+            '    runpy.run_path(%r, run_name=%r)\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'print(" ".join(sys.modules))\n'
+            ) % (
+                SCRIPT_PATH,
+                list(args),
+                SCRIPT_PATH,
+                '__main__' if args else 'autocrop_cli',
+                )
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=self.env
+            )
+        loaded = set(output.decode('utf-8').splitlines()[-1].split())
+        return [name for name in HEAVY_MODULES if name in loaded]
+
+    def test_import(self):
+        self.assertEqual(self.get_loaded_modules(), [])
+        # Importing the script must not touch the file system.
+        self.assertEqual(os.listdir(self.home), [])
+
+    def test_help(self):
+        self.assertEqual(self.get_loaded_modules('--help'), ['simple_config'])
+
+    def test_list(self):
+        self.assertEqual(self.get_loaded_modules('--list'), [])
+        self.assertEqual(self.get_loaded_modules('-l', '--refresh-scanners'), [])
+
+    def get_run_time(self, args, runs=5):
+        """Return the median time, in seconds, of running a command.
+        """
+        times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.check_call(
+                args, env=self.env, stdout=subprocess.DEVNULL
+                )
+            times.append(time.perf_counter() - started)
+        return statistics.median(times)
+
+    def test_start_time(self):
+        # The time the script takes on top of starting python. It is a few
+        # hundredths of a second, while probing the scanners takes seconds.
+        # The limit is generous, so a slow machine doesn't fail; the heavy
+        # imports are caught by the tests above.
+        python = self.get_run_time([sys.executable, '-c', 'pass'])
+        # Fill the scanner cache, so --list doesn't probe.
+        self.get_run_time([sys.executable, SCRIPT_PATH, '--list'], runs=1)
+        for arg in ('--help', '--list'):
+            with self.subTest(arg=arg):
+                run_time = self.get_run_time([sys.executable, SCRIPT_PATH, arg])
+                self.assertLess(run_time - python, STARTUP_LIMIT)
+
+
+class TestScannerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cli = load_script()
+        self.cli.AUTOCROP_DIR = self.tmp
+        self.count_file = os.path.join(self.tmp, 'count')
+        bin_dir = os.path.join(self.tmp, 'bin')
+        os.mkdir(bin_dir)
+        make_stub(
+            bin_dir,
+            'echo x >> %s\n'
+            'echo "device \\`test:0\' is a Test flatbed scanner"\n'
+            % self.count_file
+            )
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + self.old_path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.tmp)
+
+    def get_call_count(self):
+        with open(self.count_file) as f:
+            return len(f.readlines())
+
+    def test_broken_cache(self):
+        expected = [('Test flatbed scanner (test:0)', 'test:0')]
+        for content in ('[]', '{"scanners": []}', '{"time": "x"}', '{'):
+            with open(os.path.join(self.tmp, 'scanners.json'), 'w') as f:
+                f.write(content)
+            self.assertEqual(self.cli.detect_scanners(), expected)
+
+    def test_cache(self):
+        expected = [('Test flatbed scanner (test:0)', 'test:0')]
+        self.assertEqual(self.cli.detect_scanners(), expected)
+        self.assertEqual(self.cli.detect_scanners(), expected)
+        self.assertEqual(self.get_call_count(), 1)
+
+        self.assertEqual(self.cli.detect_scanners(refresh=True), expected)
+        self.assertEqual(self.get_call_count(), 2)
+
+        self.assertEqual(self.cli.detect_scanners(ttl=0), expected)
+        self.assertEqual(self.get_call_count(), 3)
+
+
+class TestMultipleScanners(unittest.TestCase):
+
+    devices = ['test:0', 'test:1', 'test:2']
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cli = load_script()
+        self.cli.AUTOCROP_DIR = self.tmp
+        bin_dir = os.path.join(self.tmp, 'bin')
+        os.mkdir(bin_dir)
+        image = Image.open(os.path.join(IMAGE_PATH, '72-dpi-4-images.jpg'))
+        image.save(os.path.join(self.tmp, 'scan.png'))
+        # Each stub scanner waits until all of them have started, so this
+        # only succeeds if they run at the same time. A device named "bad"
+        # always fails, and one named "garbage" gives data that isn't an
+        # image.
+        make_stub(
+            bin_dir,
+            '[ "$1" = -L ] && echo "device \\`test:9\' is a New scanner" && exit\n'
+            'while [ $# -gt 0 ]; do\n'
+            '    if [ "$1" = "-d" ]; then device=$2; fi\n'
+            '    shift\n'
+            'done\n'
+            '[ "$device" = bad ] && exit 1\n'
+            '[ "$device" = garbage ] && echo garbage && exit\n'
+            'touch "{tmp}/started-$device"\n'
+            'i=0\n'
+            'while [ $(ls {tmp} | grep -c started) -lt $(cat {tmp}/count) ]; do\n'
+            '    i=$((i + 1))\n'
+            '    [ $i -gt 100 ] && exit 1\n'
+            '    sleep 0.1\n'
+            'done\n'
+            'cat {tmp}/scan.png\n'.format(tmp=self.tmp)
+            )
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + self.old_path
+        self.options = Namespace(
+            target=os.path.join(self.tmp, 'photos'),
+            resolution=72,
+            precision=4,
+            deskew=False,
+            contrast=15,
+            shrink=0,
+            engine='array',
+            min_size=1.0,
+            min_gap=0.25,
+            filetype='png',
+            framed_crop=False,
+            workers=2,
+            )
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.tmp)
+
+    def set_scanner_count(self, count):
+        with open(os.path.join(self.tmp, 'count'), 'w') as f:
+            f.write(str(count))
+
+    def test_parallel_scans(self):
+        self.set_scanner_count(3)
+        # A much too strict background record for one of the devices.
+        bg_records = {'test:2': ({'red': 0, 'green': 0, 'blue': 0}, None)}
+        failed = self.cli.scan_and_crop_all(self.options, self.devices, bg_records)
+        self.assertEqual(failed, [])
+        counts = {
+            name: len(os.listdir(os.path.join(self.options.target, name)))
+            for name in os.listdir(self.options.target)
+            }
+        self.assertEqual(counts, {'test-0': 4, 'test-1': 4, 'test-2': 1})
+
+    def test_failed_scan(self):
+        self.set_scanner_count(2)
+        failed = self.cli.scan_and_crop_all(
+            self.options, self.devices[:2] + ['bad'], {}
+            )
+        self.assertEqual(failed, ['bad'])
+
+    def test_failed_crop(self):
+        self.set_scanner_count(2)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                failed = self.cli.scan_and_crop_all(
+                    self.options, ['garbage'] + self.devices[:2], {}
+                    )
+        # The devices after the one that failed are still cropped.
+        self.assertEqual(failed, ['garbage'])
+        self.assertIn('Cropping the scan from garbage failed', stderr.getvalue())
+        self.assertEqual(
+            sorted(os.listdir(self.options.target)), ['test-0', 'test-1']
+            )
+        # Only progress is printed, not the names of the devices.
+        self.assertNotIn('test:0', stdout.getvalue().splitlines())
+
+    def test_stale_devices(self):
+        # A cached device id that no longer works is replaced by the new id
+        # of the scanner.
+        self.set_scanner_count(1)
+        with contextlib.redirect_stderr(io.StringIO()):
+            failed = self.cli.rescan_stale_devices(
+                self.options, ['bad'], ['bad'], {}
+                )
+        self.assertEqual(failed, [])
+        self.assertEqual(os.listdir(self.options.target), ['test-9'])
+
+
+class TestCropFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cli = load_script()
+        image = Image.open(os.path.join(IMAGE_PATH, '72-dpi-4-images.jpg'))
+        self.input = os.path.join(self.tmp, 'in')
+        for sub in ('a', 'b'):
+            os.makedirs(os.path.join(self.input, sub))
+            image.save(os.path.join(self.input, sub, 'scan.png'))
+        self.options = Namespace(
+            target=os.path.join(self.tmp, 'photos'),
+            resolution=72,
+            precision=4,
+            deskew=False,
+            contrast=15,
+            shrink=0,
+            engine='array',
+            min_size=1.0,
+            min_gap=0.25,
+            filetype='png',
+            framed_crop=False,
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def crop_files(self, names):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.cli.crop_files(self.options, names, Background())
+        return sorted(os.listdir(self.options.target))
+
+    def test_same_names(self):
+        # Files with the same name in different directories, or given twice,
+        # must not overwrite each other's crops.
+        names = self.crop_files([self.input])
+        self.assertEqual(len(names), 8)
+        self.assertTrue(any('-a-scan-p001-' in name for name in names))
+        self.assertTrue(any('-b-scan-p001-' in name for name in names))
+
+        shutil.rmtree(self.options.target)
+        path = os.path.join(self.input, 'a', 'scan.png')
+        names = self.crop_files([path, os.path.join(self.input, 'b', 'scan.png')])
+        self.assertEqual(len(names), 8)
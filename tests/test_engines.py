@@ -0,0 +1,151 @@
+import os
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from autocrop import MultiPartImage, Background
+from autocrop.engines import ENGINES, get_engine
+from autocrop.synthetic import make_scan
+from tests.const import IMAGE_PATH
+
+DPI = 100
+PRECISION = 25
+
+# Synthetic scans that every engine must handle identically.
+SCANS = {
+    'straight': [
+        (200, 250, 250, 180, 0),
+        (600, 260, 220, 300, 0),
+        (420, 750, 500, 350, 0),
+        ],
+    'skewed': [
+        (200, 250, 250, 180, 5),
+        (600, 260, 220, 300, -4),
+        (250, 700, 300, 200, 3),
+        (620, 800, 180, 240, -2),
+        ],
+    'contact-sheet': [
+        (110 + 210 * col, 130 + 210 * row, 150, 130, (row + col) % 3 - 1)
+        for row in range(5)
+        for col in range(4)
+        ],
+    }
+
+# Real scans at 72 dpi, and the precisions to compare the engines at. At
+# fine precisions the photos split into many components, which must be
+# merged in the same order by every engine.
+REAL_SCANS = {
+    '72-dpi-4-images.jpg': (4, 8, 16, 36, 50),
+    '6-degrees-skewed.jpg': (8, 25),
+    }
+
+
+class TestEngineConformance(unittest.TestCase):
+    """Every registered engine must agree with the reference sampler engine
+    and with the known geometry of synthetic scans.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.scans = {}
+        for name, photos in SCANS.items():
+            image, labels = make_scan(photos)
+            reference = MultiPartImage(
+                image, Background(), DPI, PRECISION, engine='sampler'
+                )
+            cls.scans[name] = (image, labels, reference)
+
+    def get_boxes(self, images):
+        return [(s.left, s.top, s.right, s.bottom) for s in images.sections]
+
+    def test_boxes(self):
+        step = DPI / PRECISION
+        for name, (image, labels, reference) in self.scans.items():
+            for engine in ENGINES:
+                with self.subTest(scan=name, engine=engine):
+                    images = MultiPartImage(
+                        image, Background(), DPI, PRECISION, engine=engine
+                        )
+                    boxes = self.get_boxes(images)
+                    self.assertEqual(len(boxes), len(labels))
+                    for box, expected in zip(boxes, self.get_boxes(reference)):
+                        for value, expected_value in zip(box, expected):
+                            self.assertAlmostEqual(value, expected_value, delta=step)
+                    # Sections are one sample step larger than the photos.
+                    for label in labels:
+                        self.assertTrue(any(
+                            all(abs(a - b) <= 2 * step for a, b in zip(box, label.box))
+                            for box in boxes
+                            ))
+
+    def test_angles(self):
+        for name, (image, labels, reference) in self.scans.items():
+            expected = [
+                reference.crop_section(section)[2] for section in reference.sections
+                ]
+            for engine in ENGINES:
+                with self.subTest(scan=name, engine=engine):
+                    images = MultiPartImage(
+                        image, Background(), DPI, PRECISION, engine=engine
+                        )
+                    for section, expected_angle in zip(images.sections, expected):
+                        label = min(labels, key=lambda l: (
+                            abs(l.box[0] - section.left) + abs(l.box[1] - section.top)
+                            ))
+                        crop, margins, angle = images.crop_section(section)
+                        self.assertAlmostEqual(angle, expected_angle, delta=0.1)
+                        self.assertAlmostEqual(angle, label.angle, delta=1.0)
+                        width, height = label.size
+                        self.assertAlmostEqual(crop.size[0], width - 6, delta=6)
+                        self.assertAlmostEqual(crop.size[1], height - 6, delta=6)
+
+    def test_real_scans(self):
+        for file_name, precisions in REAL_SCANS.items():
+            image = Image.open(os.path.join(IMAGE_PATH, file_name)).convert('RGB')
+            for precision in precisions:
+                reference = MultiPartImage(
+                    image, Background(), 72, precision, False, engine='sampler'
+                    )
+                for engine in ENGINES:
+                    with self.subTest(
+                            scan=file_name, precision=precision, engine=engine):
+                        images = MultiPartImage(
+                            image, Background(), 72, precision, False,
+                            engine=engine,
+                            )
+                        self.assertEqual(
+                            self.get_boxes(images), self.get_boxes(reference)
+                            )
+
+    def test_noise(self):
+        # With this much noise, background samples all over the scan,
+        # including its last row and column, are taken for photos.
+        image, labels = make_scan(SCANS['skewed'], noise=6)
+        for precision in (12, 25):
+            reference = MultiPartImage(
+                image, Background(), DPI, precision, False, 5, engine='sampler'
+                )
+            for engine in ENGINES:
+                with self.subTest(precision=precision, engine=engine):
+                    images = MultiPartImage(
+                        image, Background(), DPI, precision, False, 5,
+                        engine=engine,
+                        )
+                    self.assertEqual(
+                        self.get_boxes(images), self.get_boxes(reference)
+                        )
+
+    def test_auto(self):
+        image, labels, reference = self.scans['straight']
+        self.assertIn(get_engine('auto', image).name, ENGINES)
+        self.assertEqual(get_engine('auto', image.convert('L')).name, 'sampler')
+        self.assertRaises(ValueError, get_engine, 'missing')
+
+
+class TestMatchesArray(unittest.TestCase):
+
+    def test_integer_medians(self):
+        # Integer medians must not wrap around with 8 bit pixels.
+        black = Background({'red': 0, 'green': 0, 'blue': 0})
+        pixels = np.full((2, 2, 3), 250, dtype=np.uint8)
+        self.assertFalse(black.matches_array(pixels, 15).any())
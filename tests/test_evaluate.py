@@ -0,0 +1,83 @@
+import contextlib
+import io
+import unittest
+
+from autocrop.evaluate import (
+    Result, Setting, evaluate, fastest, main, make_background, make_scans,
+    pareto_front, polygon_iou,
+    )
+from autocrop.synthetic import get_corners
+
+
+class TestPolygonIou(unittest.TestCase):
+    
+    def test_iou(self):
+        square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+        shifted = [(5, 0), (15, 0), (15, 10), (5, 10)]
+        apart = [(20, 0), (30, 0), (30, 10), (20, 10)]
+        self.assertAlmostEqual(polygon_iou(square, square), 1.0)
+        self.assertAlmostEqual(polygon_iou(square, shifted), 50 / 150.0)
+        self.assertAlmostEqual(polygon_iou(square, apart), 0.0)
+        # Orientation of the corners doesn't matter.
+        self.assertAlmostEqual(polygon_iou(square, shifted[::-1]), 50 / 150.0)
+        
+        turned = get_corners(5, 5, 10, 10, 45)
+        self.assertGreater(polygon_iou(square, turned), 0.7)
+        self.assertLess(polygon_iou(square, turned), 1.0)
+
+
+class TestEvaluate(unittest.TestCase):
+    
+    def test_scans(self):
+        scans = make_scans(3, dpi=50, seed=1)
+        self.assertEqual(len(scans), 3)
+        for image, labels in scans:
+            width, height = image.size
+            self.assertTrue(labels)
+            for label in labels:
+                left, top, right, bottom = label.box
+                self.assertTrue(0 <= left < right <= width)
+                self.assertTrue(0 <= top < bottom <= height)
+    
+    def test_evaluate(self):
+        dpi = 50
+        scans = make_scans(2, dpi)
+        background = make_background(dpi)
+        results = evaluate(
+            scans, background, dpi, precisions=(10,), contrasts=(15,),
+            shrinks=(0, 3),
+            )
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertEqual(result.missed, 0)
+            self.assertEqual(result.false, 0)
+            self.assertGreater(result.iou, 0.85)
+            self.assertLess(result.max_angle_error, 1.0)
+            self.assertGreater(result.pages_per_second, 0)
+            self.assertGreater(result.peak_memory, 0)
+        # Shrinking the crops makes them cover less of the photos.
+        self.assertGreater(results[0].iou, results[1].iou)
+    
+    def test_pareto_front(self):
+        def make_result(name, iou, pages_per_second, missed=0):
+            return Result(
+                Setting('array', name, 15, 3), iou, 0.1, 0.2, missed, 0,
+                pages_per_second, 0,
+                )
+        
+        slow_accurate = make_result(1, 0.99, 1.0)
+        fast_rough = make_result(2, 0.90, 10.0)
+        beaten = make_result(3, 0.90, 5.0)
+        fast_missing = make_result(4, 0.99, 20.0, missed=1)
+        results = [slow_accurate, fast_rough, beaten, fast_missing]
+        self.assertEqual(
+            pareto_front(results), [slow_accurate, fast_rough, fast_missing]
+            )
+        self.assertEqual(fastest(results, min_iou=0.95), slow_accurate)
+        self.assertEqual(fastest(results), fast_rough)
+        self.assertIsNone(fastest(results, min_iou=1.0))
+    
+    def test_no_scans(self):
+        with self.assertRaises(SystemExit):
+            with contextlib.redirect_stderr(io.StringIO()):
+                main(['--scans', '0'])
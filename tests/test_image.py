@@ -5,6 +5,9 @@ import unittest
 from PIL import Image
 
 from autocrop import MultiPartImage, Background
+from autocrop.engines import ENGINES
+from autocrop.sampler import auto_precision
+from autocrop.synthetic import make_scan
 from tests.const import IMAGE_PATH
 
 
@@ -33,3 +36,51 @@ class TestImage(unittest.TestCase):
             width, height = image.size
             self.assertAlmostEqual(correct_width, width, delta=margin)
             self.assertAlmostEqual(correct_height, height, delta=margin)
+
+
+class TestAutoPrecision(unittest.TestCase):
+    
+    def setUp(self):
+        # A row of small prints with narrow gaps between them, and some dust.
+        photos = [(60 + 85 * i, 100, 75, 75, 0) for i in range(4)]
+        dust = [(30 + 70 * i, 300, 3, 3, 0) for i in range(5)]
+        self.image, labels = make_scan(photos + dust, size=(450, 400))
+        self.boxes = [label.box for label in labels[:4]]
+    
+    def test_auto_precision(self):
+        self.assertEqual(auto_precision(100, min_size=0.75, min_gap=0.1), 20)
+        self.assertEqual(auto_precision(300), 9)
+        self.assertEqual(auto_precision(10, min_size=0.1, min_gap=0.1), 10)
+        self.assertRaises(ValueError, auto_precision, 0)
+    
+    def test_bad_step(self):
+        # These would make the samplers loop forever.
+        for dpi, precision in ((72, -4), (0, 50), (0, 'auto')):
+            for engine in ENGINES:
+                self.assertRaises(
+                    ValueError, MultiPartImage, self.image, Background(),
+                    dpi, precision, engine=engine,
+                    )
+    
+    def test_small_photos(self):
+        for engine in ENGINES:
+            images = MultiPartImage(
+                self.image, Background(), dpi=100, precision='auto',
+                deskew=False, engine=engine, min_size=0.75, min_gap=0.1,
+                )
+            self.assertEqual(images.precision, 20)
+            self.assertEqual(len(images), 4)
+            for section, box in zip(images.sections, self.boxes):
+                for value, expected in zip(
+                        (section.left, section.top, section.right, section.bottom),
+                        box):
+                    self.assertAlmostEqual(value, expected, delta=10)
+    
+    def test_pruning(self):
+        engine = ENGINES['sampler']()
+        sections = engine.find_sections(
+            self.image, Background(), 100, 20, 15, min_area=75 ** 2
+            )
+        self.assertEqual(len(sections), 4)
+        sections = engine.find_sections(self.image, Background(), 100, 20, 15)
+        self.assertEqual(len(sections), 9)
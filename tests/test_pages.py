@@ -0,0 +1,81 @@
+import contextlib
+import io
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from autocrop import MultiPartImage, Background
+from autocrop.pages import iter_pages, iter_scans
+from tests.const import IMAGE_PATH
+
+
+class TestPages(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        photos = Image.open(os.path.join(IMAGE_PATH, '72-dpi-4-images.jpg'))
+        skewed = Image.open(os.path.join(IMAGE_PATH, '6-degrees-skewed.jpg'))
+        self.sizes = [photos.size, skewed.size, photos.size]
+        self.tiff_path = os.path.join(self.tmp, 'batch.tif')
+        photos.save(
+            self.tiff_path,
+            save_all=True,
+            append_images=[skewed, photos.convert('L')],
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_iter_pages(self):
+        with Image.open(self.tiff_path) as image:
+            pages = [(index, page.mode, page.size) for index, page in iter_pages(image)]
+        self.assertEqual(
+            pages, [(i, 'RGB', size) for i, size in enumerate(self.sizes)]
+            )
+
+    def test_crop_pages(self):
+        counts = []
+        for name, index, page in iter_scans([self.tiff_path]):
+            images = MultiPartImage(
+                page, Background(), dpi=72, deskew=False, precision=4
+                )
+            counts.append(len(images))
+        self.assertEqual(counts, [4, 1, 4])
+
+    def test_directory(self):
+        os.mkdir(os.path.join(self.tmp, 'sub'))
+        shutil.copy(
+            os.path.join(IMAGE_PATH, '6-degrees-skewed.jpg'),
+            os.path.join(self.tmp, 'sub', 'skewed.jpg'),
+            )
+        with open(os.path.join(self.tmp, 'notes.txt'), 'w') as f:
+            f.write('Not an image.')
+        # Files with image extensions that can't be decoded are skipped.
+        with open(os.path.join(self.tmp, 'broken.png'), 'wb') as f:
+            f.write(b'Not an image either.')
+        with open(os.path.join(self.tmp, 'doc.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4')
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            scans = [(name, index) for name, index, page in iter_scans([self.tmp])]
+        self.assertIn('broken.png', stderr.getvalue())
+        # PIL can save PDFs but not open them, so they aren't even tried.
+        self.assertNotIn('doc.pdf', stderr.getvalue())
+        self.assertEqual(
+            scans,
+            [
+                ('batch.tif', 0),
+                ('batch.tif', 1),
+                ('batch.tif', 2),
+                (os.path.join('sub', 'skewed.jpg'), 0),
+                ],
+            )
+
+    def test_stdin(self):
+        with open(self.tiff_path, 'rb') as f:
+            stdin = BytesIO(f.read())
+        sizes = [page.size for name, index, page in iter_scans(['-'], stdin)]
+        self.assertEqual(sizes, self.sizes)
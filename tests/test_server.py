@@ -0,0 +1,159 @@
+import base64
+from concurrent.futures.process import BrokenProcessPool
+from http.client import HTTPConnection
+from io import BytesIO
+import json
+import os
+import socket
+import threading
+import unittest
+
+from PIL import Image
+
+from autocrop import Background
+from autocrop.server import CropServer
+from tests.const import IMAGE_PATH
+
+
+class TestCropServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        background = Background()
+        cls.server = CropServer(
+            bg_records={'known': (background.medians, background.std_devs)},
+            workers=1,
+            defaults={'dpi': 72, 'precision': 4, 'deskew': False},
+            quiet=True,
+            )
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+        cls.host, cls.port = cls.server.server_address[:2]
+        cls.image_path = os.path.join(IMAGE_PATH, '72-dpi-4-images.jpg')
+        with open(cls.image_path, 'rb') as f:
+            cls.image_data = f.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def request(self, connection, method, url, body=None):
+        connection.request(method, url, body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_crop(self):
+        connection = HTTPConnection(self.host, self.port)
+        status, data = self.request(connection, 'POST', '/crop', self.image_data)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['sections']), 4)
+        for section in data['sections']:
+            left, top, right, bottom = section['box']
+            image = Image.open(BytesIO(base64.b64decode(section['image'])))
+            self.assertEqual(image.size, (right - left, bottom - top))
+
+        # A second request on the same connection only asks for geometry.
+        status, data = self.request(
+            connection, 'POST', '/crop?geometry=1&path=%s' % self.image_path
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['sections']), 4)
+        self.assertNotIn('image', data['sections'][0])
+
+        # The array engine uses a crop session, which finds the same boxes.
+        status, array_data = self.request(
+            connection, 'POST', '/crop?geometry=1&engine=array', self.image_data
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            [section['box'] for section in array_data['sections']],
+            [section['box'] for section in data['sections']],
+            )
+        connection.close()
+
+    def test_stats(self):
+        connection = HTTPConnection(self.host, self.port)
+        self.request(connection, 'POST', '/crop?geometry=1', self.image_data)
+        status, stats = self.request(connection, 'GET', '/stats')
+        self.assertEqual(status, 200)
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['workers'], 1)
+        self.assertGreaterEqual(stats['completed'], 1)
+        self.assertGreater(stats['max_latency'], 0)
+        connection.close()
+
+    def test_bad_request(self):
+        connection = HTTPConnection(self.host, self.port)
+        status, data = self.request(connection, 'POST', '/crop?dpi=high', b'x')
+        self.assertEqual(status, 400)
+        # Values that would never finish cropping.
+        for query in ('precision=-4', 'precision=0', 'dpi=0&precision=auto',
+                'dpi=-72', 'min_size=0', 'min_gap=-1'):
+            status, data = self.request(
+                connection, 'POST', '/crop?' + query, self.image_data
+                )
+            self.assertEqual(status, 400, query)
+        status, data = self.request(connection, 'POST', '/crop')
+        self.assertEqual(status, 400)
+        status, data = self.request(connection, 'POST', '/crop', b'not an image')
+        self.assertEqual(status, 500)
+        connection.close()
+
+    def test_scanner(self):
+        connection = HTTPConnection(self.host, self.port)
+        status, data = self.request(
+            connection, 'POST', '/crop?geometry=1&scanner=known', self.image_data
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['sections']), 4)
+        status, data = self.request(
+            connection, 'POST', '/crop?scanner=unknown', self.image_data
+            )
+        self.assertEqual(status, 400)
+        self.assertIn('unknown', data['error'])
+        connection.close()
+
+    def test_bad_content_length(self):
+        request = (
+            b'POST /crop HTTP/1.1\r\n'
+            b'Host: localhost\r\n'
+            b'Content-Length: abc\r\n\r\n'
+            )
+        with socket.create_connection((self.host, self.port)) as sock:
+            sock.sendall(request)
+            stream = sock.makefile('rb')
+            self.assertIn(b' 400 ', stream.readline())
+
+    def test_dead_worker(self):
+        # A worker that dies breaks the pool, which must be replaced.
+        with self.assertRaises(BrokenProcessPool):
+            self.server.pool.submit(os._exit, 1).result()
+        connection = HTTPConnection(self.host, self.port)
+        status, data = self.request(
+            connection, 'POST', '/crop?geometry=1', self.image_data
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['sections']), 4)
+        connection.close()
+
+    def test_pipelining(self):
+        request = (
+            'POST /crop?geometry=1&path=%s HTTP/1.1\r\n'
+            'Host: localhost\r\n'
+            'Content-Length: 0\r\n\r\n' % self.image_path
+            ).encode('ascii')
+        with socket.create_connection((self.host, self.port)) as sock:
+            # Send both requests before reading either response.
+            sock.sendall(request * 2)
+            stream = sock.makefile('rb')
+            for _ in range(2):
+                self.assertIn(b' 200 ', stream.readline())
+                length = 0
+                for line in iter(stream.readline, b'\r\n'):
+                    name, _, value = line.decode('ascii').partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                data = json.loads(stream.read(length))
+                self.assertEqual(len(data['sections']), 4)
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from autocrop import MultiPartImage, Background
+from autocrop.session import CropSession
+from autocrop.synthetic import make_scan
+
+DPI = 100
+PRECISION = 25
+
+
+class TestCropSession(unittest.TestCase):
+    
+    def setUp(self):
+        photos = [
+            (200, 250, 250, 180, 5),
+            (600, 260, 220, 300, -4),
+            (250, 700, 300, 200, 0),
+            ]
+        self.image, self.labels = make_scan(photos)
+        self.session = CropSession(Background(), DPI, PRECISION)
+    
+    def test_thresholds(self):
+        background = Background()
+        pixels = np.random.RandomState(0).randint(200, 256, (50, 50, 3))
+        lower, upper = background.thresholds(15)
+        matches = np.all((pixels >= lower) & (pixels <= upper), axis=2)
+        np.testing.assert_array_equal(
+            matches, background.matches_array(pixels, 15)
+            )
+    
+    def test_same_as_multipart_image(self):
+        images = MultiPartImage(self.image, Background(), DPI, PRECISION, engine='array')
+        results = list(self.session.crops(self.image))
+        self.assertEqual(len(results), len(images.sections))
+        for (section, crop, margins, angle), expected in zip(results, images.sections):
+            self.assertEqual(
+                (section.left, section.top, section.right, section.bottom),
+                (expected.left, expected.top, expected.right, expected.bottom),
+                )
+            expected_crop, expected_margins, expected_angle = images.crop_section(expected)
+            self.assertEqual(margins, expected_margins)
+            self.assertEqual(angle, expected_angle)
+            self.assertEqual(crop.size, expected_crop.size)
+            # Only the corners differ, where a rotation fills in black.
+            difference = np.abs(
+                np.asarray(crop, dtype=int) - np.asarray(expected_crop, dtype=int)
+                )
+            self.assertEqual(difference[10:-10, 10:-10].max(), 0)
+    
+    def test_reuse(self):
+        first = [crop.size for crop in self.session(self.image)]
+        layout = self.session.get_layout(np.asarray(self.image))
+        grid = layout.grid
+        blank, labels = make_scan([], size=self.image.size)
+        self.assertEqual(self.session(blank), [])
+        self.assertEqual([crop.size for crop in self.session(self.image)], first)
+        self.assertEqual(len(self.session.layouts), 1)
+        self.assertIs(self.session.get_layout(np.asarray(self.image)).grid, grid)
+        
+        # A different size of image gets its own layout.
+        small, labels = make_scan([(200, 200, 200, 200, 0)], size=(400, 400))
+        self.assertEqual(len(self.session(small)), 1)
+        self.assertEqual(len(self.session.layouts), 2)
@@ -7,7 +7,7 @@ import numpy as np
 from PIL import Image
 
 from autocrop import Background
-from autocrop.skew import SkewedImage
+from autocrop.skew import SkewedImage, analyze_sections
 from tests.const import IMAGE_PATH
 
 
@@ -31,3 +31,26 @@ class TestSkewedImage(unittest.TestCase):
         
 
 
+
+class TestAnalyzeSections(unittest.TestCase):
+    
+    def test_matches_skewed_image(self):
+        test_image_path = os.path.join(IMAGE_PATH, '6-degrees-skewed.jpg')
+        image = Image.open(test_image_path).convert('RGB')
+        pixels = np.asarray(image)
+        background = Background()
+        width, height = image.size
+        random = np.random.RandomState(0)
+        boxes = [(0, 0, width, height)]
+        for _ in range(20):
+            left, right = sorted(random.randint(0, width, 2))
+            top, bottom = sorted(random.randint(0, height, 2))
+            boxes.append((left, top, right + 20, bottom + 20))
+        boxes = [
+            (l, t, min(r, width), min(b, height)) for l, t, r, b in boxes
+            ]
+        
+        results = analyze_sections(pixels, boxes, background, 15, 3)
+        for box, result in zip(boxes, results):
+            skewed = SkewedImage(image.crop(box), background, 15, 3)
+            self.assertEqual(result, skewed.analyze())